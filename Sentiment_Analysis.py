@@ -2,60 +2,164 @@
 speeches and then consolidates results for male and female speeches.
 
 Dataframes that are created in this script are exported for Tableau visualization. They include:
-* overall_sentiment_analysis.csv
+* overall_sentiment_analysis.csv (exported from the artifact of the same name when requested)
 * mean_sentiment_per_gender.csv
 """
 
+from itertools import chain
+
 import pandas as pd
 import numpy as np
 
-from sklearn.feature_extraction.text import  CountVectorizer
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from topic_modeling import new_stopwords
+from aggregate_cube import sentiment_rows, slice_rows
+from artifact_store import export_csv, read_artifact, write_artifact
+from instrumentation import instrumented
+from stop_words import new_stopwords
+from topic_modeling import top_k_indices
+from vader_scoring import score_texts
+
+def tokenize_speeches(speeches):
+    """Returns the words of every speech in one flat list, and an array of offsets where offsets[i]
+    is the position of speech i's first word (the last entry is the total word count). Each speech
+    is split into words only once; sections are then taken as slices of this list.
+    """
+
+    tokenized = speeches.str.split()
+    lengths = tokenized.str.len().to_numpy(dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    return list(chain.from_iterable(tokenized)), offsets
+
+def section_bounds(lengths, n_sections=10):
+    """Returns the start and end word positions of n equal sections of each speech, as two arrays
+    of shape (speeches, n_sections). Each section holds int(length / n_sections) words; leftover
+    words at the end of a speech are not part of any section.
+    """
+
+    size = lengths // n_sections
+    starts = size[:, None] * np.arange(n_sections)
+
+    return starts, starts + size[:, None]
+
+def window_bounds(lengths, window, overlap=0):
+    """Returns the speech number, window number, start and end word positions of sliding windows
+    of `window` words that overlap by `overlap` words. Windows cover every word, so the last window
+    of a speech can be shorter.
+    """
+
+    step = window - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than the window")
+
+    counts = 1 + np.maximum(0, -(-(lengths - window) // step))
+    speech_numbers = np.repeat(np.arange(len(lengths)), counts)
+    window_numbers = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts = window_numbers * step
+    ends = np.minimum(starts + window, lengths[speech_numbers])
 
-def split_speeches(data):
+    return speech_numbers, window_numbers, starts, ends
+
+def section_texts(tokens, starts, ends):
+    """Returns the text of each section, given start and end positions in the flat word list."""
+    return [' '.join(tokens[start:end]) for start, end in zip(starts, ends)]
+
+@instrumented
+def split_speeches(data, n_sections=10):
     """Returns the dataframe with ten new columns, each including a 10th of the origonal
-    speech. This enables comparison of sentiment throughout the speech.
+    speech. This enables comparison of sentiment throughout the speech. Any other number of
+    sections can be requested with n_sections.
     """
-    for n in range(10):
-        data[f's{n}'] = data.speech.str.split().apply(lambda x: ' '.join(x[n*int(len(x)/10):
-                                                                           (n+1)*int(len(x)/10)]))
+    tokens, offsets = tokenize_speeches(data.speech)
+    starts, ends = section_bounds(np.diff(offsets), n_sections)
+    first_word = offsets[:-1]
+
+    for n in range(n_sections):
+        data[f's{n}'] = section_texts(tokens, first_word + starts[:, n], first_word + ends[:, n])
 
     return data
 
-def obtain_comp_score(data_with_splits):
+@instrumented
+def speech_sections(data, n_sections=10, window=None, overlap=0):
+    """Returns a long dataframe with one row per section of each speech: the speech's index label,
+    the section number, its start and end word positions, and its text. Sections are n_sections
+    equal parts, or sliding windows of `window` words overlapping by `overlap` if window is given.
+    """
+    tokens, offsets = tokenize_speeches(data.speech)
+    lengths = np.diff(offsets)
+
+    if window is None:
+        starts, ends = section_bounds(lengths, n_sections)
+        speech_numbers = np.repeat(np.arange(len(lengths)), n_sections)
+        section_numbers = np.tile(np.arange(n_sections), len(lengths))
+        starts, ends = starts.ravel(), ends.ravel()
+    else:
+        speech_numbers, section_numbers, starts, ends = window_bounds(lengths, window, overlap)
+
+    first_word = offsets[speech_numbers]
+
+    return pd.DataFrame({'speech_id': data.index[speech_numbers],
+                         'section': section_numbers,
+                         'start': starts,
+                         'end': ends,
+                         'text': section_texts(tokens, first_word + starts, first_word + ends)})
+
+@instrumented
+def obtain_comp_score(data_with_splits, n_sections=10, processes=None, export_csvs=False):
     """Returns the dataframe with a new column indicating the sentiment analysis score for
     each section of the speech. For example, section 0 of the speech will have an output
-    column 'comp0' that indicates the compilation sentiment score of seciton 0.
+    column 'comps0' that indicates the compilation sentiment score of seciton 0. The other
+    VADER scores are added as 'negs0', 'neus0' and 'poss0'.
+
+    All sections of all speeches are scored in one batch across a process pool, and sections
+    whose text was scored in an earlier run are read from the score cache. The scores, without
+    the speech and section text, are saved as the 'overall_sentiment_analysis' artifact.
     """
-    analyser = SentimentIntensityAnalyzer()
+    section_cols = [f's{n}' for n in range(n_sections)]
+    n_speeches = len(data_with_splits)
+
+    # score every section in one batch - rows are section 0 of each speech, then section 1, ...
+    texts = list(chain.from_iterable(data_with_splits[col] for col in section_cols))
+    scores = score_texts(texts, processes)
 
-    for n in range(10):
-        col = 's' + n
-        new_col = 'comp' + col
-        data_with_splits[new_col] = data_with_splits[col].apply(lambda x:
-                                                                analyser.polarity_scores(x)
-                                                                ['compound'])
+    for n, col in enumerate(section_cols):
+        section_scores = scores.iloc[n * n_speeches:(n + 1) * n_speeches]
+        data_with_splits['comp' + col] = section_scores['compound'].to_numpy()
+        data_with_splits['neg' + col] = section_scores['neg'].to_numpy()
+        data_with_splits['neu' + col] = section_scores['neu'].to_numpy()
+        data_with_splits['pos' + col] = section_scores['pos'].to_numpy()
 
-    data_with_splits.to_csv('overall_sentiment_analysis.csv')
+    write_artifact(data_with_splits.drop(['speech'] + section_cols, axis=1),
+                   'overall_sentiment_analysis')
+    if export_csvs:
+        export_csv('overall_sentiment_analysis')
 
     return data_with_splits
 
-def sentiment_by_gender(sentiment_data):
+@instrumented
+def sentiment_by_gender(sentiment_data, n_sections=10, cube=None):
     """Prints the mean sentiment score by gender for each section of the speeches.
     Creates a dataframe of speech sentiment by gender and exports to csv to be used
     for Tableau visualization.
+
+    Args:
+    sentiment_data -- the sentiment output, with comps0..comps{n_sections - 1} columns
+    n_sections -- number of sections each speech was split into
+    cube -- sentiment aggregate cube; without one the means are taken from sentiment_data with
+    a single groupby
     """
+
+    if cube is None:
+        rows = sentiment_rows(sentiment_data, n_sections, ['gender', 'section'], ['compound'])
+        section_table = slice_rows(rows, ['gender', 'section'], ['compound'])
+    else:
+        section_table = cube.slice('gender', 'section')
+
     # view the average sentiment for each section of the speeches by gender
-    sent_by_gender = sentiment_data.groupby('gender')['comps1', 'comps2', 'comps3',
-                                                      'comps4', 'comps5', 'comps6',
-                                                      'comps7', 'comps8', 'comps9',
-                                                      'comps10'].agg(['mean'])
+    sent_by_gender = section_table['mean_compound'].unstack('gender')
     print('Sentiment score by gender:', sent_by_gender)
 
     # create a dataframe of mean sentiment by gender to export for Tableau visualization
-    sent_each = pd.DataFrame({'f':list(sent_by_gender.iloc[0, :].values),
-                              'm': list(sent_by_gender.iloc[1, :].values)})
+    sent_each = pd.DataFrame({'f': sent_by_gender['1'], 'm': sent_by_gender['0']})
     sent_each.to_csv('mean_sentiment_per_gender.csv')
 
 
@@ -67,34 +171,117 @@ def top_words_single_section(data, section):
     section -- the speech section to provide a list of top words for
     """
 
-    cv = CountVectorizer(stop_words=new_stopwords(), ngram_range=(1, 1))
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    cv = CountVectorizer(stop_words=sorted(new_stopwords()), ngram_range=(1, 1))
     data_cv = cv.fit_transform(data[section])
 
-    data_dtm = pd.DataFrame(data_cv.toarray(), columns=cv.get_feature_names())
-    data_dtm.index = data.index
+    # sum the sparse counts directly instead of building a dense documents x words frame
+    word_counts = np.asarray(data_cv.sum(axis=0)).ravel()
 
-    top_words_ls = np.sum(data_dtm, axis=0).sort_values(ascending=False)
+    top_words_ls = pd.Series(word_counts, index=cv.get_feature_names_out())
+    top_words_ls = top_words_ls.sort_values(ascending=False)
 
     return top_words_ls
 
-def top_words_all_sections(data):
+def section_word_counts(data, n_sections=10):
+    """Returns a sparse word count matrix over every section text and its feature names. The
+    vocabulary is fit once for all sections. Rows are blocked by section: section 0 of every
+    speech first, then section 1, and so on.
+    """
+
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    texts = chain.from_iterable(data[f's{n}'] for n in range(n_sections))
+
+    cv = CountVectorizer(stop_words=sorted(new_stopwords()), ngram_range=(1, 1))
+    data_cv = cv.fit_transform(texts)
+
+    return data_cv, cv.get_feature_names_out()
+
+def group_word_counts(word_counts, group_codes, n_groups):
+    """Returns a sparse (groups x words) matrix with the summed counts of the rows in each group.
+    Rows with a negative group code are left out.
+    """
+
+    from scipy import sparse
+
+    rows = np.flatnonzero(group_codes >= 0)
+    indicator = sparse.csr_matrix((np.ones(len(rows), dtype=word_counts.dtype),
+                                   (group_codes[rows], rows)),
+                                  shape=(n_groups, word_counts.shape[0]))
+
+    return indicator @ word_counts
+
+def top_k_words(word_counts, feature_names, k=10):
+    """Returns a series with the k most used words and their counts, most used first."""
+
+    top = top_k_indices(word_counts, k)
+    return pd.Series(word_counts[top], index=feature_names[top])
+
+@instrumented
+def top_words_by_group(data, by=None, n_sections=10, k=10):
+    """Returns a dictionary mapping (section, group) to a series of the k most used words in that
+    section for speeches in that group, e.g. per gender or per top topic. All counts come from one
+    vectorizer fit and one sparse reduction.
+
+    Args:
+    data -- a dataframe with the speeches split into sections
+    by -- column name (or list of column names) to group speeches by; None groups by section only
+    n_sections -- number of section columns
+    k -- number of words per group
+    """
+
+    data_cv, feature_names = section_word_counts(data, n_sections)
+    n_speeches = len(data)
+
+    if by is None:
+        speech_codes, group_values = np.zeros(n_speeches, dtype=np.int64), np.array([None])
+    else:
+        keys = data[by] if isinstance(by, str) else pd.Series(list(zip(*[data[col] for col in by])))
+        speech_codes, group_values = pd.factorize(keys)
+
+    # one group per (section, group value) pair, matching the section-blocked rows
+    n_values = len(group_values)
+    row_codes = np.repeat(np.arange(n_sections), n_speeches) * n_values
+    row_codes = np.where(np.tile(speech_codes, n_sections) >= 0,
+                         row_codes + np.tile(speech_codes, n_sections), -1)
+
+    grouped = group_word_counts(data_cv, row_codes, n_sections * n_values).toarray()
+
+    top_words = {}
+    for code, counts in enumerate(grouped):
+        section, value = divmod(code, n_values)
+        key = (section,) if by is None else (section, group_values[value])
+        top_words[key] = top_k_words(counts, feature_names, k)
+
+    return top_words
+
+@instrumented
+def top_words_all_sections(data, by=None, n_sections=10, k=10):
     """Prints a list of the most commonly used words in each of the ten
-    sections of the speech.
+    sections of the speech, optionally for each group of speeches (e.g. by='gender').
     """
 
-    for n in range(10):
-        print(f"Top words in section {n}:")
-        print(top_words_single_section(data, f's{n}')[:10])
+    for key, top_words in top_words_by_group(data, by, n_sections, k).items():
+        if by is None:
+            print(f"Top words in section {key[0]}:")
+        else:
+            print(f"Top words in section {key[0]} for {by} {key[1]}:")
+        print(top_words)
 
-def main():
+@instrumented
+def main(export_csvs=False):
     """Imports the commencement speeches, then breaks each speech into 10
     sections for sentiment analysis. Performs vader sentiment analysis on each
     section and then analyzes the results per gender.
     """
-    model_output = pd.read_csv('topic_modeling_output.csv')
+    # every column, so the topic weights are carried into the sentiment output as before
+    model_output = read_artifact('topic_modeling_output')
     split_df = split_speeches(model_output)
-    sentiment_df = obtain_comp_score(split_df)
+    sentiment_df = obtain_comp_score(split_df, export_csvs=export_csvs)
     sentiment_by_gender(sentiment_df)
     top_words_all_sections(sentiment_df)
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+A materialized aggregate cube for the gender / topic / sentiment reports. For every combination
+of dimensions (all 2^k rollups of, e.g., gender x top_topic x year x school x section) the cube
+keeps the count, sum and sum of squares of each measure. Means and standard deviations of any
+slice are then read straight from the cube instead of regrouping the speeches, and new speeches
+are added by merging their aggregates into the stored ones.
+
+The sentiment cube is saved with pickle and only ever needs the new speeches to be updated.
+"""
+
+import os
+import pickle
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+CUBE_PATH = 'aggregates/sentiment_cube.pkl'
+SPEECH_KEY = ['name', 'school', 'year']
+SENTIMENT_DIMENSIONS = ['gender', 'top_topic', 'year', 'school', 'section']
+TOPIC_DIMENSIONS = ['gender', 'top_topic', 'year', 'school']
+
+# measure name -> prefix of its per-section columns in the sentiment output, e.g. comps0
+SENTIMENT_MEASURES = {'compound': 'comp', 'neg': 'neg', 'neu': 'neu', 'pos': 'pos'}
+
+class AggregateCube:
+    """Counts, sums and sums of squares of the measures for every rollup of the dimensions.
+
+    Args:
+    dimensions -- columns to aggregate by
+    measures -- numeric columns to aggregate; with none the cube only counts rows
+    """
+
+    def __init__(self, dimensions, measures=()):
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.speech_keys = set()
+        self.tables = {}
+
+    def rollup(self, dimensions):
+        """Returns the dimensions in the cube's order, the key of their rollup table."""
+
+        unknown = set(dimensions).difference(self.dimensions)
+        if unknown:
+            raise KeyError(f"Not a dimension of the cube: {sorted(unknown)}")
+
+        return tuple(dim for dim in self.dimensions if dim in dimensions)
+
+    def add(self, rows):
+        """Adds the aggregates of a dataframe with a column for every dimension and measure to
+        every rollup. Only the new rows are aggregated; each stored table is then merged with
+        the new aggregates, so earlier rows are never read again.
+        """
+
+        stats = row_stats(rows, self.measures)
+
+        for n_dims in range(len(self.dimensions) + 1):
+            for group in combinations(self.dimensions, n_dims):
+                table = aggregate(rows, group, stats)
+
+                old = self.tables.get(group)
+                if old is not None:
+                    if group:
+                        table = pd.concat([old, table]).groupby(
+                            level=list(range(len(group))), dropna=False, observed=True).sum()
+                    else:
+                        table = old + table
+
+                self.tables[group] = table
+
+    def lookup(self, **values):
+        """Returns the count and the mean and standard deviation of each measure for one cell,
+        e.g. lookup(gender='1', section=0). Dimensions that aren't given are rolled up. The
+        lookup is a single hashed index access.
+        """
+
+        group = self.rollup(values)
+        table = self.tables.get(group)
+
+        if table is None:
+            # nothing added yet
+            row = pd.Series(0, index=self.stat_columns())
+        elif not group:
+            row = table.iloc[0]
+        else:
+            key = tuple(values[dim] for dim in group)
+            try:
+                row = table.loc[key if len(key) > 1 else key[0]]
+            except KeyError:
+                row = pd.Series(0, index=table.columns)
+
+        return with_moments(row.to_frame().T, self.measures).iloc[0].to_dict()
+
+    def slice(self, *dimensions):
+        """Returns the rollup table over the given dimensions, with the count, sum and sum of
+        squares of each measure and its mean and standard deviation, one row per cell.
+        """
+        return with_moments(self.tables[self.rollup(dimensions)], self.measures)
+
+    def stat_columns(self):
+        """Returns the names of the stored statistics."""
+        return ['count'] + [f'{stat}_{measure}' for measure in self.measures
+                            for stat in ('sum', 'sumsq')]
+
+def row_stats(rows, measures=()):
+    """Returns a dataframe with each row's count (1) and the value and square of each measure,
+    named like the cube's statistics.
+    """
+
+    stats = {'count': np.ones(len(rows), dtype=np.int64)}
+    for measure in measures:
+        values = rows[measure].to_numpy(dtype=float)
+        stats[f'sum_{measure}'] = values
+        stats[f'sumsq_{measure}'] = values * values
+
+    return pd.DataFrame(stats, index=rows.index)
+
+def aggregate(rows, dimensions, stats):
+    """Returns the row statistics summed over each combination of the dimensions (a single
+    'all' row if there are none) - one rollup table, from one groupby.
+    """
+
+    if not dimensions:
+        return stats.sum().to_frame('all').T
+
+    return pd.concat([rows[list(dimensions)], stats], axis=1).groupby(
+        list(dimensions), dropna=False, observed=True).sum()
+
+def slice_rows(rows, dimensions, measures=()):
+    """Returns the same table as AggregateCube.slice over the dimensions, computed straight from
+    the rows with one groupby instead of building every rollup of a cube.
+    """
+    return with_moments(aggregate(rows, dimensions, row_stats(rows, measures)), measures)
+
+def with_moments(table, measures=()):
+    """Returns the table of counts, sums and sums of squares with a mean and (population)
+    standard deviation column added for each measure.
+    """
+
+    table = table.copy()
+    count = table['count'].to_numpy(dtype=float)
+    safe_count = np.where(count > 0, count, 1)
+
+    for measure in measures:
+        mean = table[f'sum_{measure}'].to_numpy(dtype=float) / safe_count
+        mean_square = table[f'sumsq_{measure}'].to_numpy(dtype=float) / safe_count
+        table[f'mean_{measure}'] = np.where(count > 0, mean, np.nan)
+        table[f'std_{measure}'] = np.where(count > 0,
+                                           np.sqrt(np.maximum(mean_square - mean * mean, 0)),
+                                           np.nan)
+
+    return table
+
+def sentiment_rows(sentiment_data, n_sections=10, dimensions=SENTIMENT_DIMENSIONS,
+                   measures=SENTIMENT_MEASURES):
+    """Returns the sentiment output in long form: one row per section of each speech, with the
+    speech's gender, top topic, year and school, the section number, and its compound, neg, neu
+    and pos scores (read from the comps0, negs0, ... columns). Only the given dimensions and
+    measures are included.
+    """
+
+    n_speeches = len(sentiment_data)
+    rows = pd.DataFrame({dim: np.tile(sentiment_data[dim].to_numpy(dtype=object), n_sections)
+                         for dim in dimensions if dim != 'section'})
+    if 'section' in dimensions:
+        rows['section'] = np.repeat(np.arange(n_sections), n_speeches)
+
+    for measure in measures:
+        prefix = SENTIMENT_MEASURES[measure]
+        rows[measure] = np.concatenate([sentiment_data[f'{prefix}s{n}'].to_numpy(dtype=float)
+                                        for n in range(n_sections)])
+
+    return rows
+
+def build_sentiment_cube(sentiment_data, n_sections=10):
+    """Returns a new sentiment cube over gender x top_topic x year x school x section holding
+    the speeches in the sentiment output.
+    """
+
+    cube = AggregateCube(SENTIMENT_DIMENSIONS, SENTIMENT_MEASURES)
+    add_speeches(cube, sentiment_data, n_sections)
+
+    return cube
+
+def add_speeches(cube, sentiment_data, n_sections=10):
+    """Adds the speeches of the sentiment output that the cube doesn't hold yet, identified by
+    name, school and year. Returns the number of speeches added.
+    """
+
+    keys = list(zip(*(sentiment_data[col] for col in SPEECH_KEY)))
+    is_new = np.array([key not in cube.speech_keys for key in keys], dtype=bool)
+    new_speeches = sentiment_data[is_new]
+    if new_speeches.empty:
+        return 0
+
+    cube.add(sentiment_rows(new_speeches, n_sections))
+    cube.speech_keys.update(key for key, new in zip(keys, is_new) if new)
+
+    return len(new_speeches)
+
+def save_cube(cube, cube_path=CUBE_PATH):
+    """Pickles the cube, replacing the saved one in a single step."""
+
+    os.makedirs(os.path.dirname(cube_path) or '.', exist_ok=True)
+    with open(cube_path + '.tmp', 'wb') as file:
+        pickle.dump(cube, file)
+    os.replace(cube_path + '.tmp', cube_path)
+
+def load_cube(cube_path=CUBE_PATH):
+    """Returns the saved cube, or None if there isn't one."""
+
+    if not os.path.exists(cube_path):
+        return None
+
+    with open(cube_path, 'rb') as file:
+        return pickle.load(file)
+
+def speech_hashes(sentiment_data, n_sections=10):
+    """Returns a dictionary mapping each speech's (name, school, year) to a hash of the
+    dimensions and scores the cube aggregates for it.
+    """
+
+    columns = [dim for dim in SENTIMENT_DIMENSIONS if dim != 'section'] + \
+        [f'{prefix}s{n}' for prefix in SENTIMENT_MEASURES.values() for n in range(n_sections)]
+    hashes = pd.util.hash_pandas_object(sentiment_data[columns].astype(str), index=False)
+    keys = zip(*(sentiment_data[col] for col in SPEECH_KEY))
+
+    return dict(zip(keys, hashes.tolist()))
+
+def update_sentiment_cube(sentiment_data, cube_path=CUBE_PATH, n_sections=10, source_hash=None):
+    """Adds the new speeches of the sentiment output to the saved sentiment cube (creating it if
+    needed), saves it and returns it. Speeches already in the cube are not added again.
+
+    Aggregates can't be taken back out of the cube, so if a speech it holds has left the output
+    or changed (e.g. a refitted topic model gave it another top topic), the cube is rebuilt
+    from the whole output instead. Finding those speeches hashes every speech of the output,
+    a full scan; pass source_hash to skip it when the output is the one the cube was last
+    updated from.
+
+    Args:
+    sentiment_data -- the sentiment output
+    cube_path -- file the cube is saved to
+    n_sections -- number of sections each speech was split into
+    source_hash -- content hash of the file sentiment_data was read from, recorded with the cube
+    """
+
+    cube = load_cube(cube_path)
+    if source_hash is not None and getattr(cube, 'source_hash', None) == source_hash:
+        print(f"Sentiment cube is up to date ({len(cube.speech_keys)} speeches)")
+        return cube
+
+    hashes = speech_hashes(sentiment_data, n_sections)
+
+    stored = getattr(cube, 'speech_hashes', None)
+    if cube is not None and (stored is None or
+                             any(hashes.get(key) != value for key, value in stored.items())):
+        print("Speeches in the sentiment cube changed - rebuilding it")
+        cube = None
+
+    if cube is None:
+        cube = AggregateCube(SENTIMENT_DIMENSIONS, SENTIMENT_MEASURES)
+
+    added = add_speeches(cube, sentiment_data, n_sections)
+    cube.speech_hashes = {key: hashes[key] for key in cube.speech_keys}
+    cube.source_hash = source_hash
+    print(f"Added {added} speeches to the sentiment cube ({len(cube.speech_keys)} in total)")
+
+    save_cube(cube, cube_path)
+    return cube
@@ -0,0 +1,151 @@
+"""
+Columnar storage for the data handed from one stage of the analysis to the next. Each artifact is
+a typed Parquet file: later stages can load only the columns they need, reads are memory-mapped,
+and low-cardinality columns such as gender and top topic are stored as categoricals.
+
+Tableau csv files are exported from the artifacts only when asked for. An artifact can also carry
+a few string key/value pairs of metadata, e.g. the version of the model that produced it.
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ARTIFACT_DIR = 'artifacts'
+CATEGORICAL_COLUMNS = ['gender', 'top_topic']
+
+def artifact_path(name, artifact_dir=ARTIFACT_DIR):
+    """Returns the file path of the artifact with the given name."""
+    return os.path.join(artifact_dir, f'{name}.parquet')
+
+def to_table(data, schema=None, metadata=None):
+    """Returns the dataframe as an Arrow table, with CATEGORICAL_COLUMNS stored as categoricals.
+    The dataframe index is not stored. metadata is a dictionary of strings added to the schema.
+    """
+
+    categoricals = {col: data[col].astype('category') for col in CATEGORICAL_COLUMNS
+                    if col in data.columns and data[col].dtype.name != 'category'}
+    if categoricals:
+        data = data.assign(**categoricals)
+
+    table = pa.Table.from_pandas(data, schema=schema, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            **{str(key).encode(): str(value).encode() for key, value in metadata.items()}})
+
+    return table
+
+def write_artifact(data, name, artifact_dir=ARTIFACT_DIR, metadata=None):
+    """Saves a dataframe as the named artifact, replacing any earlier version in a single step.
+    Returns the artifact's path.
+
+    Args:
+    data -- the dataframe to save
+    name -- name of the artifact
+    artifact_dir -- directory holding the artifacts
+    metadata -- dictionary of strings saved with the artifact, see read_artifact_metadata
+    """
+
+    path = artifact_path(name, artifact_dir)
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    pq.write_table(to_table(data, metadata=metadata), path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+    return path
+
+class ArtifactWriter:
+    """Writes a dataframe artifact one chunk at a time, so the full table never has to be in
+    memory. The artifact only replaces the previous version once the writer is closed without an
+    error. Use as a context manager. metadata is a dictionary of strings saved with the artifact.
+    """
+
+    def __init__(self, name, artifact_dir=ARTIFACT_DIR, metadata=None):
+        self.path = artifact_path(name, artifact_dir)
+        self.artifact_dir = artifact_dir
+        self.metadata = metadata
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+
+    def write(self, data):
+        """Appends a dataframe chunk; every chunk must have the same columns as the first."""
+
+        if self._writer is None:
+            table = to_table(data, metadata=self.metadata)
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            self._schema = table.schema
+            self._writer = pq.ParquetWriter(self.path + '.tmp', self._schema)
+        else:
+            table = to_table(data, self._schema)
+
+        self._writer.write_table(table)
+        self.rows += len(data)
+
+    def close(self, keep=True):
+        """Finishes the file and, if keep is True, makes it the current version of the artifact."""
+
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+        if keep:
+            os.replace(self.path + '.tmp', self.path)
+        else:
+            os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(keep=exc_type is None)
+
+def read_artifact(name, columns=None, artifact_dir=ARTIFACT_DIR, memory_map=True):
+    """Returns the named artifact as a dataframe.
+
+    Args:
+    name -- name of the artifact
+    columns -- columns to load; None loads all of them
+    artifact_dir -- directory holding the artifacts
+    memory_map -- read the file through a memory map instead of copying it into memory first
+    """
+
+    table = pq.read_table(artifact_path(name, artifact_dir), columns=columns,
+                          memory_map=memory_map)
+    return table.to_pandas()
+
+def read_artifact_metadata(name, artifact_dir=ARTIFACT_DIR):
+    """Returns the metadata saved with the named artifact as a dictionary of strings, without
+    reading its data.
+    """
+
+    metadata = pq.read_schema(artifact_path(name, artifact_dir)).metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items() if key != b'pandas'}
+
+def iter_artifact_batches(name, batch_size=1000, columns=None, artifact_dir=ARTIFACT_DIR):
+    """Yields the named artifact as dataframes of at most batch_size rows, so artifacts larger
+    than memory can be processed one batch at a time.
+
+    Args:
+    name -- name of the artifact
+    batch_size -- rows per dataframe
+    columns -- columns to load; None loads all of them
+    artifact_dir -- directory holding the artifacts
+    """
+
+    parquet_file = pq.ParquetFile(artifact_path(name, artifact_dir), memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def export_csv(name, csv_path=None, columns=None, artifact_dir=ARTIFACT_DIR):
+    """Exports the named artifact as a csv file for Tableau, by default as <name>.csv. Returns the
+    path of the csv file.
+    """
+
+    csv_path = csv_path or f'{name}.csv'
+    read_artifact(name, columns, artifact_dir).to_csv(csv_path, index=False)
+
+    return csv_path
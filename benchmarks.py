@@ -0,0 +1,720 @@
+"""
+Benchmarks for the speech analysis code. They run on synthetic commencement speeches so the
+results can be compared at sizes well beyond NPR's 350 speeches.
+
+Run a benchmark from the command line, for example:
+    python benchmarks.py cleaning --docs 350 5000
+    python benchmarks.py pipeline --docs 350 10000 --output results.json --baseline old.json
+
+Results can be saved as JSON with --output and compared with an earlier run with --baseline;
+any time or memory figure that grew by more than the tolerance is reported as a regression.
+"""
+
+import argparse
+import contextlib
+import html
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SPEECH_WORDS = ['the', 'and', 'to', 'of', 'you', 'a', 'that', 'in', 'i', 'is', 'we', 'it', 'your',
+                'for', 'this', 'be', 'have', 'are', 'will', 'with', 'what', 'not', 'all', 'they',
+                'but', 'as', 'was', 'our', 'my', 'can', 'do', 'on', 'so', 'life', 'world', 'people',
+                'work', 'time', 'make', 'graduates', 'class', 'future', 'dream', 'dreams', 'hope',
+                'change', 'love', 'learn', 'learned', 'school', 'college', 'education', 'teachers',
+                'students', 'career', 'job', 'jobs', 'business', 'success', 'failure', 'fail',
+                'country', 'government', 'politics', 'president', 'america', 'american', 'power',
+                'freedom', 'justice', 'democracy', 'war', 'peace', 'culture', 'art', 'music',
+                'books', 'history', 'community', 'family', 'friends', 'parents', 'mother',
+                'father', 'courage', 'passion', 'purpose', 'believe', 'happy', 'happiness', 'fear',
+                'afraid', 'brave', 'strong', 'hard', 'wonderful', 'amazing', 'beautiful', 'best',
+                'better', 'worst', 'bad', 'sad', 'angry', 'lost', 'win', 'won', 'grateful', 'proud',
+                'remember', 'years', 'moment', 'journey', 'path', 'road', 'choice', 'choices',
+                'risk', 'opportunity', 'leaders', 'leadership', 'service', 'serve', 'help',
+                'kindness', 'truth', 'honest', 'question', 'questions', 'answer', 'problem',
+                'problems', 'science', 'technology', 'money', 'poverty', 'rich', 'poor',
+                'generation', 'young', 'no', 'never', 'very', 'really', 'extremely', 'barely',
+                'dont', 'cant', 'running', 'leaves', 'women', 'men', 'became', 'studies', 'cities',
+                'feet']
+
+# Tokens carrying the noise found in scraped captions: bracketed cues, punctuation, numbers,
+# smart quotes and an ellipsis.
+NOISE_TOKENS = ['[Applause]', '[Music]', '[Laughter]', 'it’s', '“dream”', 'world.', 'you,',
+                'today!', 'why?', '2019', '1st', '20th', 'well…', "don't", "we're",
+                'class-of-2019', '(laughs)', 'yes;', 'co-workers', '$100']
+
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 're', 'si', 'to',
+             'vu', 'wa', 'ye', 'zo', 'bri', 'cla', 'dre', 'fli', 'gro', 'pla', 'sto', 'tra', 'ing',
+             'er', 'ly', 'tion', 'ment', 'ness', 'an', 'el', 'or', 'ul']
+
+def synthetic_vocabulary(vocab_size=20000, seed=19):
+    """Returns a list of vocab_size words: SPEECH_WORDS first, followed by a long tail of made-up
+    words built from syllables, so vectorizers see a vocabulary as large as the real corpus.
+    """
+
+    rng = np.random.default_rng(seed)
+    vocabulary = list(SPEECH_WORDS)
+    seen = set(vocabulary)
+
+    while len(vocabulary) < vocab_size:
+        word = ''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+
+    return vocabulary[:vocab_size]
+
+def synthetic_speeches(n_docs, mean_words=2500, vocab_size=20000, noise_rate=.03, seed=19):
+    """Returns a list of n_docs synthetic raw transcripts. Words follow a Zipf distribution over a
+    synthetic vocabulary, lengths vary around mean_words, and a share of the tokens carry the same
+    kind of noise as the scraped captions. Line breaks are sprinkled in as in YouTube transcripts.
+
+    Args:
+    n_docs -- number of transcripts to generate
+    mean_words -- average number of words per transcript
+    vocab_size -- number of distinct words to draw from
+    noise_rate -- share of tokens replaced with a noisy token
+    seed -- random seed, so each run generates the same corpus
+    """
+
+    rng = np.random.default_rng(seed)
+    words = np.array(synthetic_vocabulary(vocab_size, seed), dtype=object)
+    noise = np.array(NOISE_TOKENS, dtype=object)
+    weights = 1 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+
+    lengths = np.maximum(rng.lognormal(np.log(mean_words), .4, n_docs).astype(int), 20)
+
+    speeches = []
+    for length in lengths:
+        tokens = words[rng.choice(len(words), size=length, p=weights)]
+        noisy = rng.random(length) < noise_rate
+        tokens[noisy] = noise[rng.integers(0, len(noise), noisy.sum())]
+        separators = np.where(rng.random(length) < .08, '\n', ' ')
+        speeches.append(''.join(token + sep for token, sep in zip(tokens, separators)))
+
+    return speeches
+
+FIRST_NAMES = ['Michelle', 'Barack', 'Oprah', 'Steve', 'Maya', 'John', 'Ruth', 'Neil', 'Toni',
+               'David', 'Sheryl', 'Conan', 'Ellen', 'Bill', 'Madeleine', 'Denzel', 'Sonia',
+               'Kurt', 'Hillary', 'Jeff', 'Melinda', 'Stephen', 'Nora', 'Tom', 'Amy', 'Ben']
+LAST_NAMES = ['Obama', 'Winfrey', 'Jobs', 'Angelou', 'Lewis', 'Ginsburg', 'Gaiman', 'Morrison',
+              'Foster', 'Sandberg', "O'Brien", 'DeGeneres', 'Gates', 'Albright', 'Washington',
+              'Sotomayor', 'Vonnegut', 'Clinton', 'Bezos', 'Colbert', 'Ephron', 'Hanks',
+              'Poehler', 'Franklin']
+SCHOOLS = ['Harvard University', 'Stanford University', 'Wellesley College', 'Tulane University',
+           'Kenyon College', 'Syracuse University', 'Princeton University', 'Barnard College',
+           'Dartmouth College', 'University of Michigan', 'Howard University', 'Yale University',
+           'Spelman College', 'University of the Arts', 'Smith College', 'Vassar College']
+
+def synthetic_corpus(n_docs, mean_words=2500, female_share=.3, seed=19):
+    """Returns a dataframe of n_docs synthetic speeches shaped like the scraped collection: the
+    speaker name, school and year (as text, like the NPR page), the raw transcript, and a gender
+    designation ('1' female, '0' male). Every (name, school, year) is unique.
+
+    Args:
+    n_docs -- number of speeches to generate
+    mean_words -- average number of words per transcript
+    female_share -- share of speeches given by women
+    seed -- random seed, so each run generates the same corpus
+    """
+
+    rng = np.random.default_rng(seed)
+    first = rng.choice(FIRST_NAMES, n_docs)
+    last = rng.choice(LAST_NAMES, n_docs)
+
+    return pd.DataFrame({
+        'name': [f'{a} {b} {i}' for i, (a, b) in enumerate(zip(first, last))],
+        'school': rng.choice(SCHOOLS, n_docs),
+        'year': rng.integers(1950, 2020, n_docs).astype(str),
+        'speech': synthetic_speeches(n_docs, mean_words, seed=seed),
+        'gender': np.where(rng.random(n_docs) < female_share, '1', '0')})
+
+def npr_page(corpus):
+    """Returns the html of a speech list page laid out like NPR's, listing the corpus speeches."""
+
+    entries = [f'<h2 class="speech-name">{html.escape(name)}</h2>'
+               f'<p class="speech-school">{html.escape(school)}</p>'
+               f'<p class="speech-year">{year}</p>'
+               for name, school, year in zip(corpus.name, corpus.school, corpus.year)]
+
+    return '<html><body>' + '\n'.join(entries) + '</body></html>'
+
+class FakeElement:
+    """A page element of FakeDriver: always visible, clickable, and holding the given text."""
+
+    def __init__(self, text=''):
+        self.text = text
+
+    def click(self):
+        pass
+
+    def is_displayed(self):
+        return True
+
+class FakeDriver:
+    """Stands in for a Selenium driver on YouTube: every search finds a video, and its transcript
+    is the synthetic transcript of the speech searched for.
+
+    Args:
+    transcripts -- dictionary mapping each search query to the transcript to return
+    """
+
+    def __init__(self, transcripts):
+        self.transcripts = transcripts
+        self.transcript = ''
+
+    def get(self, url):
+        query = url.split('search_query=', 1)[-1]
+        self.transcript = self.transcripts.get(query, '')
+
+    def find_element(self, by=None, value=None):
+        return FakeElement(self.transcript)
+
+    def find_element_by_id(self, element_id):
+        return FakeElement(self.transcript)
+
+    def find_element_by_xpath(self, xpath):
+        return FakeElement(self.transcript)
+
+    def quit(self):
+        pass
+
+def timed(func):
+    """Returns the result of calling func and the wall time it took in seconds."""
+
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def profiled(func):
+    """Returns the result of calling func, the wall time in seconds, and the peak memory in MB
+    allocated while it ran, as traced by tracemalloc.
+    """
+
+    tracemalloc.start()
+    try:
+        result, seconds = timed(func)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, seconds, peak / 1e6
+
+def print_results(results):
+    """Prints a list of benchmark result dictionaries as a table."""
+    print(pd.DataFrame(results).to_string(index=False))
+
+def benchmark_text_cleaning(doc_counts=(350,), processes=4, mean_words=2500):
+    """Returns and prints the throughput in MB/s of the original two-round cleaning and of
+    text_cleaning's single-process and multiprocessing paths, and checks that every path returns
+    byte-identical text.
+
+    Args:
+    doc_counts -- corpus sizes to run
+    processes -- worker processes for the multiprocessing path
+    mean_words -- average words per synthetic speech
+    """
+    from data_preprocessing import clean_text_round1, clean_text_round2
+    from text_cleaning import clean_series, clean_texts
+
+    results = []
+    for n_docs in doc_counts:
+        texts = synthetic_speeches(n_docs, mean_words)
+        speeches = pd.Series(texts)
+        megabytes = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+
+        runs = {'two rounds (current)': lambda: speeches.apply(lambda x: clean_text_round1(x))
+                                                        .apply(lambda x: clean_text_round2(x)),
+                'precompiled, series': lambda: clean_series(speeches),
+                f'precompiled, {processes} processes':
+                    lambda: pd.Series(clean_texts(texts, processes))}
+
+        reference = None
+        for method, run in runs.items():
+            cleaned, seconds = timed(run)
+            if reference is None:
+                reference = cleaned.tolist()
+
+            results.append({'benchmark': 'text_cleaning', 'docs': n_docs, 'method': method,
+                            'mb': round(megabytes, 2), 'seconds': round(seconds, 3),
+                            'mb_per_sec': round(megabytes / seconds, 2),
+                            'identical': cleaned.tolist() == reference})
+
+    print_results(results)
+    return results
+
+def benchmark_sparse_matrices(doc_counts=(350, 10000, 100000), mean_words=1000,
+                              dense_limit_gb=4):
+    """Returns and prints time and peak memory of the TF-IDF + NMF topic model and of the
+    top-words reduction, with the document-term matrix kept sparse versus densified as before.
+    Dense runs that would need more than dense_limit_gb for the matrix alone are skipped.
+
+    Args:
+    doc_counts -- corpus sizes to run
+    mean_words -- average words per synthetic speech
+    dense_limit_gb -- largest dense matrix to attempt, in GB
+    """
+    from sklearn.decomposition import NMF
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+    from text_cleaning import clean_text
+    from stop_words import new_stopwords
+
+    stop_words = sorted(new_stopwords())
+
+    def topic_model(texts, dense):
+        vectorizer = TfidfVectorizer(stop_words=stop_words, max_df=.8, min_df=.3)
+        doc_term = vectorizer.fit_transform(texts)
+        if dense:
+            doc_term = doc_term.toarray()
+        return NMF(5, random_state=19).fit_transform(doc_term)
+
+    def top_words(texts, dense):
+        cv = CountVectorizer(stop_words=stop_words)
+        data_cv = cv.fit_transform(texts)
+        if dense:
+            data_dtm = pd.DataFrame(data_cv.toarray(), columns=cv.get_feature_names_out())
+            return np.sum(data_dtm, axis=0).sort_values(ascending=False)
+        word_counts = np.asarray(data_cv.sum(axis=0)).ravel()
+        return pd.Series(word_counts, index=cv.get_feature_names_out()).sort_values(ascending=False)
+
+    results = []
+    for n_docs in doc_counts:
+        texts = [clean_text(text) for text in synthetic_speeches(n_docs, mean_words)]
+        n_words = len(CountVectorizer(stop_words=stop_words).fit(texts).vocabulary_)
+        dense_gb = n_docs * n_words * 8 / 1e9
+
+        for stage, run in (('tfidf + nmf', topic_model), ('top words', top_words)):
+            for layout in ('sparse', 'dense'):
+                row = {'benchmark': 'sparse_matrices', 'docs': n_docs, 'stage': stage,
+                       'layout': layout, 'seconds': None, 'peak_mb': None}
+
+                if layout == 'dense' and dense_gb > dense_limit_gb:
+                    row['note'] = f'skipped, dense counts need {dense_gb:.1f} GB'
+                else:
+                    _, seconds, peak_mb = profiled(lambda: run(texts, layout == 'dense'))
+                    row.update(seconds=round(seconds, 3), peak_mb=round(peak_mb, 1), note='')
+                results.append(row)
+
+    print_results(results)
+    return results
+
+def benchmark_vader_scoring(doc_counts=(350,), processes=4, mean_words=2500):
+    """Returns and prints the throughput in sections/sec of scoring ten sections per speech with
+    the per-column .apply loop used before, with the batched scorer in one process and in a process
+    pool, and with the batched scorer reading a warm cache. Checks every path against the .apply
+    loop's scores.
+
+    Args:
+    doc_counts -- corpus sizes to run
+    processes -- worker processes for the pool
+    mean_words -- average words per synthetic speech
+    """
+    import tempfile
+
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    from Sentiment_Analysis import split_speeches
+    from text_cleaning import clean_text
+    from vader_scoring import VADER_FIELDS, score_texts
+
+    analyser = SentimentIntensityAnalyzer()
+
+    def serial(sections):
+        polarity = [score for col in sections
+                    for score in sections[col].apply(lambda x: analyser.polarity_scores(x))]
+        return pd.DataFrame(polarity)[VADER_FIELDS]
+
+    results = []
+    for n_docs in doc_counts:
+        speeches = pd.DataFrame({'speech': [clean_text(text) for text in
+                                            synthetic_speeches(n_docs, mean_words)]})
+        sections = split_speeches(speeches)[[f's{n}' for n in range(10)]]
+        texts = [text for col in sections for text in sections[col]]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = f'{cache_dir}/vader_cache.pkl'
+            runs = {'per-column apply (current)': lambda: serial(sections),
+                    'batched, 1 process': lambda: score_texts(texts, 1, cache_path=None),
+                    f'batched, {processes} processes': lambda: score_texts(texts, processes,
+                                                                           cache_path=cache_path),
+                    'batched, warm cache': lambda: score_texts(texts, processes,
+                                                               cache_path=cache_path)}
+
+            reference = None
+            for method, run in runs.items():
+                scores, seconds = timed(run)
+                if reference is None:
+                    reference = scores.to_numpy()
+
+                results.append({'benchmark': 'vader_scoring', 'docs': n_docs, 'method': method,
+                                'sections': len(texts), 'seconds': round(seconds, 3),
+                                'sections_per_sec': round(len(texts) / seconds, 1),
+                                'identical': bool((scores.to_numpy() == reference).all())})
+
+    print_results(results)
+    return results
+
+def benchmark_lexicon_sentiment(doc_counts=None, speeches_artifact='topic_modeling_output',
+                                mean_words=2500):
+    """Returns and prints an accuracy-vs-speed report of the vectorized lexicon scorer against
+    the reference SentimentIntensityAnalyzer, on ten sections per speech. Uses the existing
+    speeches unless synthetic corpus sizes are given.
+
+    Args:
+    doc_counts -- synthetic corpus sizes to run; None scores the speeches in speeches_artifact
+    speeches_artifact -- artifact with the cleaned speeches in a 'speech' column
+    mean_words -- average words per synthetic speech
+    """
+    from artifact_store import read_artifact
+    from lexicon_sentiment import score_sections
+    from Sentiment_Analysis import speech_sections
+    from text_cleaning import clean_text
+    from vader_scoring import VADER_FIELDS, score_texts
+
+    if doc_counts is None:
+        corpora = {'existing speeches': read_artifact(speeches_artifact, columns=['speech'])}
+    else:
+        corpora = {}
+        for n_docs in doc_counts:
+            texts = [clean_text(text) for text in synthetic_speeches(n_docs, mean_words)]
+            corpora[f'{n_docs} synthetic'] = pd.DataFrame({'speech': texts})
+
+    results = []
+    for corpus, speeches in corpora.items():
+        speeches = speeches.dropna().reset_index(drop=True)
+        texts = speech_sections(speeches).text.tolist()
+
+        reference, reference_seconds = timed(lambda: score_texts(texts, 1, cache_path=None))
+        approximate, seconds = timed(lambda: score_sections(speeches))
+
+        compound = approximate.compound.to_numpy()
+        reference_compound = reference.compound.to_numpy()
+        row = {'benchmark': 'lexicon_sentiment', 'corpus': corpus, 'sections': len(texts),
+               'vader_seconds': round(reference_seconds, 3), 'lexicon_seconds': round(seconds, 3),
+               'speedup': round(reference_seconds / seconds, 1),
+               'compound_corr': round(np.corrcoef(compound, reference_compound)[0, 1], 4),
+               'compound_sign_agreement': round(np.mean(np.sign(compound) ==
+                                                        np.sign(reference_compound)), 4)}
+        for field in VADER_FIELDS:
+            error = np.abs(approximate[field].to_numpy() - reference[field].to_numpy())
+            row[f'{field}_mae'] = round(error.mean(), 4)
+        results.append(row)
+
+    print_results(results)
+    return results
+
+STARTUP_COMMANDS = {
+    'cli --help': ['cli.py', '--help'],
+    'import stage modules': ['-c', 'import web_scraping_npr_youtube, data_preprocessing, '
+                                   'topic_modeling, Sentiment_Analysis, pipeline'],
+    'import heavy dependencies': ['-c', 'import bs4, requests, pymongo, selenium.webdriver, '
+                                        'scipy.sparse, sklearn.decomposition, '
+                                        'sklearn.feature_extraction.text, nltk.corpus, '
+                                        'nltk.stem, nltk.sentiment.vader']}
+
+def benchmark_startup(repeats=5):
+    """Returns and prints the best of `repeats` wall times, in a fresh interpreter, for showing
+    the command line help, for importing every stage module, and for importing the heavy
+    dependencies the stage modules used to load at import time - the start-up cost every command
+    paid before those imports were made lazy.
+
+    Args:
+    repeats -- number of times each command is run
+    """
+
+    results = []
+    for name, command in STARTUP_COMMANDS.items():
+        seconds = []
+        for _ in range(repeats):
+            _, elapsed = timed(lambda: subprocess.run([sys.executable, *command], check=True,
+                                                      stdout=subprocess.DEVNULL))
+            seconds.append(elapsed)
+        results.append({'benchmark': 'startup', 'command': name,
+                        'best_seconds': round(min(seconds), 3)})
+
+    print_results(results)
+    return results
+
+def scrape_locally(corpus, n_workers=4):
+    """Returns the scraped speeches for a synthetic corpus, running the real scraping code
+    against local stand-ins: the speech list is served by the replay server and transcripts come
+    from FakeDriver sessions, with no rate limiting. Must be run in a scratch directory.
+    """
+    from http_cache import start_replay_server
+    from web_scraping_npr_youtube import scrape_npr, scrape_speech_transcripts
+
+    os.makedirs('site', exist_ok=True)
+    os.makedirs('data', exist_ok=True)
+    with open(os.path.join('site', 'index.html'), 'w', encoding='utf-8') as file:
+        file.write(npr_page(corpus))
+
+    server, base_url = start_replay_server('site')
+    try:
+        speeches = scrape_npr(url=base_url, cache_dir='http_cache')
+    finally:
+        server.shutdown()
+
+    transcripts = {f'{name} {school} {year} commencement speech': speech for name, school, year,
+                   speech in zip(corpus.name, corpus.school, corpus.year, corpus.speech)}
+
+    return scrape_speech_transcripts(speeches, n_workers, min_interval=0, jitter=0,
+                                     driver_factory=lambda: FakeDriver(transcripts),
+                                     pause=lambda low, high: None)
+
+def load_and_read_mongo(corpus, chunk_size=100):
+    """Upserts the corpus into an in-memory mongomock collection and streams it back out in
+    chunks. Returns the speeches read back as one dataframe.
+    """
+    import mongomock
+
+    from mongo_store import COLLECTION, DATABASE, SPEECH_FIELDS, bulk_upsert_speeches, \
+        iter_speech_chunks
+
+    collection = mongomock.MongoClient()[DATABASE][COLLECTION]
+    bulk_upsert_speeches(corpus[SPEECH_FIELDS].values.tolist(), collection)
+
+    return pd.concat(iter_speech_chunks(collection, chunk_size), ignore_index=True)
+
+PIPELINE_STAGES = ['scrape', 'mongo', 'clean_reference', 'clean', 'lemmatize', 'topic_model',
+                   'split', 'sentiment', 'gender_aggregates']
+
+def benchmark_pipeline(doc_counts=(350, 10000), mean_words=2500, stages=None, processes=4,
+                       scrape_limit=10000, scrape_workers=4, trace_memory=True):
+    """Returns and prints the wall time and peak traced memory of every stage of the analysis on
+    synthetic corpora, from scraping to the gender aggregations. Stages run in a scratch
+    directory with their printed output silenced, so no project files are touched.
+
+    Each stage from 'clean' on feeds the next, so running a later stage also runs the ones
+    before it; only the requested stages are reported. 'lemmatize' starts from an empty lemma
+    cache and leaves it filled for 'topic_model', as in a normal run. A stage that fails is
+    reported with its error instead of stopping the benchmark.
+
+    For very large corpora, lower mean_words and pick the stages, e.g. 1M speeches of 200 words
+    with stages=['clean', 'lemmatize', 'topic_model'].
+
+    Args:
+    doc_counts -- corpus sizes to run
+    mean_words -- average words per synthetic speech
+    stages -- names from PIPELINE_STAGES to report; None reports all of them
+    processes -- worker processes for text cleaning and sentiment scoring
+    scrape_limit -- largest number of speeches put through the scraper stand-ins
+    scrape_workers -- fake driver sessions scraping at once
+    trace_memory -- trace peak memory with tracemalloc, which slows Python-heavy stages down
+    """
+    from data_preprocessing import add_gender_column, clean_dataframe, clean_text_round1, \
+        clean_text_round2
+    from Sentiment_Analysis import obtain_comp_score, sentiment_by_gender, split_speeches
+    from text_cleaning import clean_speeches
+    from topic_modeling import compare_genders, create_lemmatized_words, topic_modeling
+
+    stages = PIPELINE_STAGES if stages is None else stages
+    chain_stages = PIPELINE_STAGES[PIPELINE_STAGES.index('clean'):]
+    last_needed = max([chain_stages.index(stage) for stage in stages if stage in chain_stages],
+                      default=-1)
+    measure = profiled if trace_memory else lambda func: (*timed(func), None)
+
+    results = []
+    start_dir = os.getcwd()
+
+    for n_docs in doc_counts:
+        corpus = synthetic_corpus(n_docs, mean_words)
+
+        def run(stage, func, source):
+            """Runs one stage on the source dataframe if it is requested or a later stage needs
+            its output. Returns the stage output, or None if it was skipped or failed.
+            """
+            needed = stage in chain_stages and chain_stages.index(stage) <= last_needed
+            if source is None or (stage not in stages and not needed):
+                return None
+
+            row = {'benchmark': 'pipeline', 'documents': n_docs, 'stage': stage,
+                   'rows_in': len(source)}
+            try:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    output, seconds, peak_mb = measure(func)
+            except Exception as error:
+                output = None
+                row['error'] = f'{type(error).__name__}: {error}'
+            else:
+                row.update({'rows_out': None if output is None else len(output),
+                            'seconds': round(seconds, 3),
+                            'peak_mb': None if peak_mb is None else round(peak_mb, 1)})
+
+            if stage in stages:
+                results.append(row)
+            return output
+
+        def clean():
+            speeches = corpus.drop(columns='gender')
+            speeches['speech'] = clean_speeches(speeches.speech, processes)
+            cleaned = clean_dataframe(speeches)
+            return add_gender_column(cleaned, corpus.gender[cleaned.index].tolist())
+
+        def gender_aggregates():
+            compare_genders(topics)
+            sentiment_by_gender(sentiment)
+            return None
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                scrape_corpus = corpus.iloc[:scrape_limit]
+                run('scrape', lambda: scrape_locally(scrape_corpus, scrape_workers), scrape_corpus)
+                run('mongo', lambda: load_and_read_mongo(corpus), corpus)
+                run('clean_reference', lambda: [clean_text_round2(clean_text_round1(text))
+                                                for text in corpus.speech], corpus)
+
+                cleaned = run('clean', clean, corpus)
+                lemmatized = run('lemmatize', lambda: create_lemmatized_words(cleaned.copy()),
+                                 cleaned)
+                topics = run('topic_model', lambda: topic_modeling(cleaned.copy()), lemmatized)
+                split = run('split', lambda: split_speeches(topics.copy()), topics)
+                sentiment = run('sentiment',
+                                lambda: obtain_comp_score(split.copy(), processes=processes),
+                                split)
+                run('gender_aggregates', gender_aggregates, sentiment)
+            finally:
+                os.chdir(start_dir)
+
+    print_results(results)
+    return results
+
+def save_results(name, results, output_path):
+    """Saves benchmark results as JSON, together with when and where they were run."""
+
+    report = {'benchmark': name,
+              'created': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'results': results}
+
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=1, default=lambda value: value.item())
+
+def load_results(path):
+    """Returns the list of result rows saved by save_results."""
+
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)['results']
+
+def is_cost(field):
+    """Returns True for result fields that measure time or memory, where lower is better."""
+    return 'seconds' in field or field.endswith('_mb')
+
+def compare_results(results, baseline, tolerance=.25, min_seconds=.05, min_mb=1):
+    """Returns a list of regressions: time and memory figures that grew by more than tolerance
+    compared with the baseline row for the same configuration. Rows are matched on all of their
+    fields that aren't measurements. Changes smaller than min_seconds or min_mb are ignored as
+    noise.
+
+    Args:
+    results -- result rows of this run
+    baseline -- result rows of an earlier run
+    tolerance -- allowed relative growth, e.g. .25 for 25%
+    min_seconds -- smallest change in seconds counted as a regression
+    min_mb -- smallest change in MB counted as a regression
+    """
+
+    def key(row):
+        return tuple(sorted((field, value) for field, value in row.items()
+                            if not isinstance(value, float) and field != 'error'))
+
+    baseline_rows = {key(row): row for row in baseline}
+    regressions = []
+
+    for row in results:
+        before = baseline_rows.get(key(row))
+        if before is None:
+            continue
+
+        for field, value in row.items():
+            old = before.get(field)
+            if not is_cost(field) or value is None or old is None:
+                continue
+
+            floor = min_mb if field.endswith('_mb') else min_seconds
+            if value > old * (1 + tolerance) and value - old > floor:
+                regressions.append({**dict(key(row)), 'measure': field, 'baseline': old,
+                                    'current': value, 'change': f'{value / old - 1:+.0%}'})
+
+    return regressions
+
+BENCHMARKS = {'cleaning': benchmark_text_cleaning,
+              'sparse': benchmark_sparse_matrices,
+              'vader': benchmark_vader_scoring,
+              'lexicon': benchmark_lexicon_sentiment,
+              'startup': benchmark_startup,
+              'pipeline': benchmark_pipeline}
+
+def run_benchmark(name, options=None, output_path=None, baseline_path=None, tolerance=.25):
+    """Runs the named benchmark and returns its results. The results are saved as JSON to
+    output_path, and any regressions against the results saved at baseline_path are printed.
+
+    Args:
+    name -- key of the benchmark in BENCHMARKS
+    options -- keyword arguments for the benchmark function
+    output_path -- JSON file to save the results to
+    baseline_path -- JSON file of an earlier run to compare with
+    tolerance -- allowed relative growth in time or memory before it counts as a regression
+    """
+
+    results = BENCHMARKS[name](**(options or {}))
+
+    if output_path:
+        save_results(name, results, output_path)
+
+    if baseline_path:
+        regressions = compare_results(results, load_results(baseline_path), tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions compared with {baseline_path}:")
+            print_results(regressions)
+        else:
+            print(f"No regressions compared with {baseline_path}")
+
+    return results
+
+def main(argv=None):
+    """Runs the benchmark named on the command line."""
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--docs', type=int, nargs='+',
+                        help="synthetic corpus sizes to run (default: the benchmark's own)")
+    parser.add_argument('--mean-words', type=int, help="average words per synthetic speech")
+    parser.add_argument('--stages', nargs='+', choices=PIPELINE_STAGES,
+                        help="pipeline stages to report (pipeline benchmark only)")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help="relative growth in time or memory reported as a regression")
+    args = parser.parse_args(argv)
+
+    options = {option: value for option, value in [('doc_counts', args.docs),
+                                                     ('mean_words', args.mean_words),
+                                                     ('stages', args.stages)]
+               if value is not None}
+
+    # not every benchmark takes every option, e.g. startup runs no synthetic corpus
+    accepted = inspect.signature(BENCHMARKS[args.benchmark]).parameters
+    unsupported = [option for option in options if option not in accepted]
+    if unsupported:
+        flags = {'doc_counts': '--docs', 'mean_words': '--mean-words', 'stages': '--stages'}
+        parser.error(f"the {args.benchmark} benchmark doesn't take "
+                     f"{', '.join(flags[option] for option in unsupported)}")
+
+    run_benchmark(args.benchmark, options, args.output, args.baseline, args.tolerance)
+
+if __name__ == '__main__':
+    main()
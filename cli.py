@@ -0,0 +1,208 @@
+"""
+Command line entry point for every stage of the analysis.
+
+Usage:
+    python cli.py scrape | remove-duplicates | clean | topics | sentiment | sweep | run | search |
+        benchmark ...
+
+Only argparse is imported at start-up. Each subcommand imports the stage it runs when it is
+called, and the stage modules themselves load selenium, pymongo, sklearn and nltk only inside the
+functions that use them, so `python cli.py --help` or a light subcommand returns immediately.
+
+With --trace every stage's wall and CPU time, peak memory and row counts are recorded, for example
+    python cli.py --trace trace.json --profile-dir profiles topics
+"""
+
+import argparse
+
+def scrape(args):
+    """Scrapes the speech list and transcripts and uploads them to MongoDB."""
+    import web_scraping_npr_youtube
+    web_scraping_npr_youtube.main(n_workers=args.workers, offline=args.offline)
+
+def clean(args):
+    """Cleans the speeches stored in MongoDB into the cleaned_speeches artifact."""
+    import data_preprocessing
+    data_preprocessing.main(chunk_size=args.chunk_size, processes=args.processes,
+                            export_csvs=args.export_csvs)
+
+def topics(args):
+    """Fits the topic model and compares topics between male and female speakers."""
+    import topic_modeling
+
+    if not args.streaming:
+        topic_modeling.main(export_csvs=args.export_csvs)
+        return
+
+    if args.source == 'mongo':
+        read_chunks = topic_modeling.mongo_chunks(args.chunk_size)
+    else:
+        read_chunks = topic_modeling.artifact_chunks(chunk_size=args.chunk_size)
+    topic_modeling.streaming_topic_modeling(read_chunks, args.vectorizer,
+                                            export_csvs=args.export_csvs)
+
+def sentiment(args):
+    """Scores the sentiment of each speech section and compares it between genders."""
+    import Sentiment_Analysis
+    Sentiment_Analysis.main(export_csvs=args.export_csvs)
+
+def sweep(args):
+    """Fits the topic model over a range of topic counts and prints the results."""
+    from artifact_store import read_artifact
+    from topic_modeling import topic_model_sweep
+
+    results = topic_model_sweep(read_artifact('cleaned_speeches'), args.components,
+                                processes=args.processes, warm_start=not args.cold_start)
+    print(results.to_string(index=False))
+
+def remove_duplicates(args):
+    """Lists the speeches stored more than once in MongoDB and removes all but the first copy."""
+    from mongo_store import find_duplicate_speeches, get_speech_collection, \
+        remove_duplicate_speeches
+
+    collection = get_speech_collection()
+    duplicates = find_duplicate_speeches(collection)
+    for key, ids in duplicates:
+        print(f"{key}: {len(ids)} copies")
+
+    if not args.yes:
+        print(f"{len(duplicates)} duplicated speeches - rerun with --yes to remove the extra "
+              "copies")
+        return
+
+    removed = remove_duplicate_speeches(collection)
+    print(f"Removed {removed} documents - regenerate m_f_designation.pkl before cleaning, since "
+          "gender designations are matched to speeches by position")
+
+def run(args):
+    """Runs the pipeline, skipping the stages that are up to date."""
+    from pipeline import run_pipeline
+    run_pipeline(only=args.only, force=args.force, adopt=args.adopt)
+
+def search(args):
+    """Builds the speech search index, or finds similar speeches or speeches using some terms."""
+    from search_index import build_search_index, load_search_index, save_search_index
+
+    if args.build:
+        index = build_search_index(args.version)
+        save_search_index(index)
+    else:
+        index = load_search_index(args.version)
+
+    filters = {'top_topic': args.topic, 'gender': args.gender,
+               'years': tuple(args.years) if args.years else None}
+
+    if args.similar:
+        positions = index.locate(args.similar)
+        if not len(positions):
+            print(f"No speech by a speaker matching '{args.similar}'")
+            return
+        print(index.similar(positions[0], args.k, **filters).to_string(index=False))
+    elif args.terms:
+        print(index.search(args.terms, args.k, rank_by=args.rank_by, **filters)
+              .to_string(index=False))
+
+def benchmark(args):
+    """Runs one of the benchmarks in benchmarks.py."""
+    import benchmarks
+    benchmarks.main(args.arguments)
+
+# kept here rather than imported so building the parser never imports a stage module
+STAGE_NAMES = ['scrape', 'clean', 'topic_model', 'sentiment', 'gender_aggregates']
+
+def build_parser():
+    """Returns the argument parser with one subcommand per stage."""
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--trace', metavar='PATH',
+                        help="record time, memory and row counts of each stage to this JSON file")
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help="also save a cProfile dump of each stage in this folder")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(func, name):
+        command = subcommands.add_parser(name, help=func.__doc__)
+        command.set_defaults(func=func)
+        return command
+
+    command = add_command(scrape, 'scrape')
+    command.add_argument('--workers', type=int, default=4, help="browser drivers run at once")
+    command.add_argument('--offline', action='store_true',
+                         help="read the NPR speech list from the local cache only")
+
+    command = add_command(remove_duplicates, 'remove-duplicates')
+    command.add_argument('--yes', action='store_true',
+                         help="remove the extra copies instead of only listing them")
+
+    command = add_command(clean, 'clean')
+    command.add_argument('--chunk-size', type=int, default=100,
+                         help="speeches read from MongoDB at a time")
+    command.add_argument('--processes', type=int, default=1,
+                         help="worker processes for text cleaning")
+    command.add_argument('--export-csvs', action='store_true', help="also write Tableau csvs")
+
+    for func, name in [(topics, 'topics'), (sentiment, 'sentiment')]:
+        command = add_command(func, name)
+        command.add_argument('--export-csvs', action='store_true',
+                             help="also write Tableau csvs")
+
+    command = subcommands.choices['topics']
+    command.add_argument('--streaming', action='store_true',
+                         help="read the speeches in chunks instead of all at once")
+    command.add_argument('--source', choices=['artifact', 'mongo'], default='artifact',
+                         help="where streaming mode reads the speeches from")
+    command.add_argument('--chunk-size', type=int, default=1000,
+                         help="speeches per chunk in streaming mode")
+    command.add_argument('--vectorizer', choices=['vocabulary', 'hashing'], default='vocabulary',
+                         help="streaming mode vectorizer")
+
+    command = add_command(sweep, 'sweep')
+    command.add_argument('--components', type=int, nargs='+', default=list(range(3, 11)),
+                         help="topic counts to try")
+    command.add_argument('--processes', type=int, help="worker processes (default: all CPUs)")
+    command.add_argument('--cold-start', action='store_true',
+                         help="fit every topic count from scratch")
+
+    command = add_command(run, 'run')
+    command.add_argument('--only', nargs='+', choices=STAGE_NAMES, help="stages to consider")
+    command.add_argument('--force', action='store_true', help="run even up to date stages")
+    command.add_argument('--adopt', action='store_true',
+                         help="record existing outputs as up to date without running")
+
+    command = add_command(search, 'search')
+    command.add_argument('--build', action='store_true',
+                         help="rebuild and save the index over the topic modeling output first")
+    command.add_argument('--version', type=int,
+                         help="topic model version (default: the version recorded with the "
+                              "topic modeling output)")
+    command.add_argument('--similar', metavar='NAME',
+                         help="find the speeches most similar to this speaker's speech")
+    command.add_argument('--terms', nargs='+', help="find the speeches using all these terms")
+    command.add_argument('--rank-by', metavar='TOPIC',
+                         help="rank term matches by this topic's weight instead of term count")
+    command.add_argument('--topic', help="only speeches with this top topic")
+    command.add_argument('--gender', choices=['0', '1'],
+                         help="only male (0) or female (1) speakers")
+    command.add_argument('--years', type=int, nargs='+', metavar='YEAR',
+                         help="only speeches from this year, or from a first and last year")
+    command.add_argument('-k', type=int, default=10, help="number of speeches to show")
+
+    command = add_command(benchmark, 'benchmark')
+    command.add_argument('arguments', nargs=argparse.REMAINDER,
+                         help="arguments for benchmarks.py, e.g. pipeline --docs 350 10000")
+
+    return parser
+
+def main(argv=None):
+    """Parses the command line and runs the chosen subcommand."""
+
+    args = build_parser().parse_args(argv)
+
+    if args.trace or args.profile_dir:
+        import instrumentation
+        instrumentation.enable(args.trace or instrumentation.TRACE_PATH, args.profile_dir)
+
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,27 @@
 """This script pulls commencement speeches from MongoDB and preprocesses for topic modeling."""
 
+import hashlib
 import pickle
 import re
 import string
 
-from pymongo import MongoClient
-import pandas as pd
-
-#load data from mongodb
-def pull_from_mongo():
-    """Returns a dataframe of commencement speeches stored in MongoDB."""
+from collections import Counter
 
-    client = MongoClient()
-    speech_db = client.speeches
-    speech_collection = speech_db.speech_collection
+import pandas as pd
 
-    cursor = speech_collection.find()
+from artifact_store import ArtifactWriter, export_csv
+from instrumentation import count, instrumented, span
+from mongo_store import iter_speech_chunks
+from near_duplicates import NearDuplicateIndex, find_near_duplicates, load_index, save_index
+from text_cleaning import clean_speeches
 
-    speech_df = pd.DataFrame(list(cursor))
+#load data from mongodb
+def pull_from_mongo(chunk_size=100, collection=None):
+    """Yields dataframes of at most chunk_size commencement speeches stored in MongoDB. Only the
+    speech fields are fetched, so memory use depends on the chunk size, not the collection size.
+    """
 
-    return speech_df
+    return iter_speech_chunks(collection, chunk_size)
 
 #clean text
 def clean_text_round1(text):
@@ -42,10 +44,17 @@ def clean_text_round2(text):
     text = re.sub('\n', ' ', text)
     return text
 
-def clean_dataframe(speeches_df):
-    """Returns the dataframe with duplicate values and non-enlgish transcripts removed."""
+@instrumented
+def clean_dataframe(speeches_df, seen_rows=None):
+    """Returns the dataframe with duplicate values and non-enlgish transcripts removed.
+
+    Args:
+    speeches_df -- a dataframe of speeches, possibly one chunk of the collection
+    seen_rows -- set of row hashes from earlier chunks, updated in place, so duplicates are
+    dropped across chunks as well as within one
+    """
     #drop mongodb unique ID - not needed for analysis
-    speeches_df = speeches_df.drop('_id', axis=1)
+    speeches_df = speeches_df.drop('_id', axis=1, errors='ignore')
 
     # removing two speeches that downloaded in spanish
     spanish_speeker1 = 'Henry A. Wallace'
@@ -55,44 +64,152 @@ def clean_dataframe(speeches_df):
     speeches_df = speeches_df[speeches_df.name != spanish_speeker2]
 
     # A few duplicates were loaded to Mongo - drop them and keep only the first occurance
-    speeches_df = speeches_df.drop_duplicates(keep='first')
-
-    #save cleaned data to csv file to access later
-    speeches_df.to_csv('speeches_df_basic_cleaning.csv')
+    if seen_rows is None:
+        seen_rows = set()
+    row_hashes = pd.util.hash_pandas_object(speeches_df, index=False)
+    first_seen = ~row_hashes.duplicated(keep='first') & ~row_hashes.isin(seen_rows)
+    seen_rows.update(row_hashes[first_seen])
+    count('clean_dataframe', 'duplicates_dropped', int((~first_seen).sum()))
+    speeches_df = speeches_df[first_seen]
 
     return speeches_df
 
-def add_gender_column(cleaned_speeches_df):
-    """Returns a dataframe of the cleaned speeches with the addition of a column indicating
-    the speaker's sex. 1 represents female and 0 represents male.
+@instrumented
+def drop_near_duplicates(speeches_df, index, indexed_keys=None):
+    """Returns the dataframe without the speeches that are near-duplicates of a speech already in
+    the index, e.g. the same speech scraped from two YouTube uploads with different captions. The
+    first copy seen is kept. Every speech is added to the index.
+
+    Args:
+    speeches_df -- a dataframe of cleaned speeches, possibly one chunk of the collection
+    index -- NearDuplicateIndex of the speeches seen so far
+    indexed_keys -- dictionary from unique_indexed_keys, updated in place; a speech whose
+    transcript has changed since an earlier run keeps its old key instead of being taken for a
+    near-duplicate of its earlier version. Each old key is claimed by one speech only
+    """
+
+    # name, school and year can repeat for two uploads of one speech, so the text is in the key
+    keys = [(name, school, year, hashlib.blake2b(speech.encode('utf-8'), digest_size=8).hexdigest())
+            for name, school, year, speech in zip(speeches_df.name, speeches_df.school,
+                                                  speeches_df.year, speeches_df.speech)]
+    if indexed_keys is not None:
+        for row, key in enumerate(keys):
+            old_key = indexed_keys.pop(key[:3], None)
+            if old_key is not None and key not in index.signatures:
+                keys[row] = old_key
+    near_duplicate = find_near_duplicates(keys, speeches_df.speech, index)
+    count('clean_dataframe', 'near_duplicates_dropped', int(near_duplicate.sum()))
+
+    return speeches_df[~near_duplicate]
+
+def unique_indexed_keys(index):
+    """Returns a dictionary mapping (name, school, year) to the key of the indexed speech, for
+    the speeches that are the only one indexed with their name, school and year. Two uploads of
+    one speech share them, and are then only matched by their exact transcript.
     """
 
+    identities = Counter(key[:3] for key in index.signatures)
+    return {key[:3]: key for key in index.signatures if identities[key[:3]] == 1}
+
+def load_gender_designations():
+    """Returns a list with the speaker's sex for each cleaned speech, in collection order."""
+
     # gender information stored in separate pickled document and saved in pickled list
     m_f_designation = pickle.load(open("m_f_designation.pkl", "rb"))
 
     # remove any \n new from string and split into a list
-    gender = re.sub('\n', ' ', m_f_designation).split(' ')
+    return re.sub('\n', ' ', m_f_designation).split(' ')
 
-    #create new column with speeker gender
-    cleaned_speeches_df["gender"] = gender
-
-    return cleaned_speeches_df
+@instrumented
+def add_gender_column(cleaned_speeches_df, gender=None):
+    """Returns a dataframe of the cleaned speeches with the addition of a column indicating
+    the speaker's sex. 1 represents female and 0 represents male.
 
-def main():
-    """Loads speech data from MongoDB database, cleans transcript text and dataset, then saves
-    the dataframe as a csv file.
+    Args:
+    cleaned_speeches_df -- a dataframe of cleaned speeches
+    gender -- the designations for these rows; defaults to the full saved list
     """
-    # Pull speeches from mongodb and store as df
-    speeches = pull_from_mongo()
 
-    # Text cleaning
-    speeches.speech = speeches.speech.apply(lambda x: clean_text_round1(x))
-    speeches.speech = speeches.speech.apply(lambda x: clean_text_round2(x))
+    if gender is None:
+        gender = load_gender_designations()
 
-    # Dataframe cleaning
-    cleaned_speeches = clean_dataframe(speeches)
-    cleaned_speeches = add_gender_column(cleaned_speeches)
+    #create new column with speeker gender
+    cleaned_speeches_df["gender"] = gender
 
-    cleaned_speeches.to_csv('cleaned_speeches.csv')
+    return cleaned_speeches_df
 
-main()
+def iter_cleaned_chunks(chunk_size=100, processes=1, near_duplicate_index=None,
+                        collection=None):
+    """Yields (basic, cleaned) dataframe pairs for each chunk of speeches read from MongoDB:
+    the transcripts cleaned and duplicates dropped, and the same with the speaker's gender added
+    and near-duplicates left out.
+
+    Args:
+    chunk_size -- number of speeches read from MongoDB at a time
+    processes -- worker processes for text cleaning; 1 cleans in this process
+    near_duplicate_index -- NearDuplicateIndex to check the speeches against and add them to; a
+    new one is used if not given
+    collection -- MongoDB collection to read; defaults to the speeches collection
+    """
+    gender = load_gender_designations()
+    seen_rows = set()
+    if near_duplicate_index is None:
+        near_duplicate_index = NearDuplicateIndex()
+    indexed_keys = unique_indexed_keys(near_duplicate_index)
+    n_cleaned = 0
+
+    for speeches in pull_from_mongo(chunk_size, collection):
+        # Text cleaning - same output as clean_text_round1 then round2, in one call per text
+        with span('data_preprocessing.clean_speeches', len(speeches)):
+            speeches.speech = clean_speeches(speeches.speech, processes)
+
+        # Dataframe cleaning
+        basic_cleaning = clean_dataframe(speeches, seen_rows)
+
+        chunk_gender = gender[n_cleaned:n_cleaned + len(basic_cleaning)]
+        if len(chunk_gender) < len(basic_cleaning):
+            raise ValueError(f"m_f_designation.pkl has {len(gender)} gender designations but the "
+                             "collection holds more cleaned speeches - regenerate it for the "
+                             "speeches currently stored")
+        cleaned_speeches = add_gender_column(basic_cleaning.copy(), chunk_gender)
+        n_cleaned += len(cleaned_speeches)
+
+        # near-duplicates are dropped only now, since the designations are matched by position
+        cleaned_speeches = drop_near_duplicates(cleaned_speeches, near_duplicate_index,
+                                                indexed_keys)
+
+        yield basic_cleaning, cleaned_speeches
+
+@instrumented
+def main(chunk_size=100, processes=1, export_csvs=False):
+    """Loads speech data from MongoDB database chunk by chunk, cleans transcript text and dataset,
+    then appends each chunk to the 'speeches_df_basic_cleaning' and 'cleaned_speeches' artifacts,
+    so memory use stays flat as the collection grows. Near-duplicate transcripts are left out of
+    'cleaned_speeches'. The saved near-duplicate index is loaded first, so new speeches are also
+    checked against the speeches cleaned in earlier runs, and saved again with them.
+
+    Args:
+    chunk_size -- number of speeches read from MongoDB at a time
+    processes -- worker processes for text cleaning; 1 cleans in this process
+    export_csvs -- also export both artifacts as csv files
+    """
+    near_duplicate_index = load_index()
+    print(f"Checking for near-duplicates of {len(near_duplicate_index)} indexed speeches")
+
+    with ArtifactWriter('speeches_df_basic_cleaning') as basic_cleaning, \
+         ArtifactWriter('cleaned_speeches') as cleaned:
+        # Pull speeches from mongodb one chunk at a time and save the cleaned data to access later
+        for basic_speeches, cleaned_speeches in iter_cleaned_chunks(chunk_size, processes,
+                                                                    near_duplicate_index):
+            basic_cleaning.write(basic_speeches)
+            cleaned.write(cleaned_speeches)
+
+    # keep the index so new speeches can be checked against it before they are added
+    save_index(near_duplicate_index)
+
+    if export_csvs:
+        export_csv('speeches_df_basic_cleaning')
+        export_csv('cleaned_speeches')
+
+if __name__ == '__main__':
+    main()
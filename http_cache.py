@@ -0,0 +1,158 @@
+"""
+Local cache for pages fetched over HTTP. Response bodies are stored on disk under the SHA-256 of
+their content and an index maps each URL to its body and to the ETag / Last-Modified headers used
+to revalidate it. In offline mode saved pages are replayed from disk without touching the network.
+
+Also includes a small local server that replays saved pages, so the scraping code can be tested
+and benchmarked without network access.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_DIR = 'cache/http'
+
+def load_cache_index(cache_dir=CACHE_DIR):
+    """Returns the cache index, a dictionary mapping each cached URL to its stored response."""
+
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path, encoding='utf-8') as file:
+        return json.load(file)
+
+def save_cache_index(index, cache_dir=CACHE_DIR):
+    """Writes the cache index to disk, replacing the old one in a single step."""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(index, file, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+
+def store_body(body, cache_dir=CACHE_DIR):
+    """Saves a response body under its SHA-256 digest and returns the digest. Identical bodies
+    are only stored once.
+    """
+
+    digest = hashlib.sha256(body).hexdigest()
+    object_dir = os.path.join(cache_dir, 'objects')
+    object_path = os.path.join(object_dir, digest)
+
+    if not os.path.exists(object_path):
+        os.makedirs(object_dir, exist_ok=True)
+        with open(object_path + '.tmp', 'wb') as file:
+            file.write(body)
+        os.replace(object_path + '.tmp', object_path)
+
+    return digest
+
+def read_cached_text(entry, cache_dir=CACHE_DIR):
+    """Returns the decoded body of a cache index entry."""
+
+    with open(os.path.join(cache_dir, 'objects', entry['sha256']), 'rb') as file:
+        body = file.read()
+
+    return body.decode(entry.get('encoding') or 'utf-8', errors='replace')
+
+def cached_get(url, cache_dir=CACHE_DIR, offline=False, session=None):
+    """Returns the text of the page at url and the SHA-256 digest of its body.
+
+    A cached page is revalidated with If-None-Match / If-Modified-Since and only downloaded again
+    if the server reports that it changed.
+
+    Args:
+    url -- address of the page
+    cache_dir -- directory holding the cache index and stored bodies
+    offline -- if True, serve the page from the cache only and never use the network
+    session -- optional requests session to send the request with
+    """
+
+    import requests
+
+    index = load_cache_index(cache_dir)
+    entry = index.get(url)
+
+    if offline:
+        if entry is None:
+            raise LookupError(f"{url} is not in the cache at {cache_dir}")
+        return read_cached_text(entry, cache_dir), entry['sha256']
+
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = (session or requests).get(url, headers=headers)
+    status = response.status_code
+
+    if status == 304 and entry is not None:
+        return read_cached_text(entry, cache_dir), entry['sha256']
+
+    if status != 200:
+        print(f"Error code: {status}")
+        raise requests.HTTPError(f"Error code: {status} for {url}", response=response)
+
+    digest = store_body(response.content, cache_dir)
+    index[url] = {'sha256': digest,
+                  'etag': response.headers.get('ETag'),
+                  'last_modified': response.headers.get('Last-Modified'),
+                  'encoding': response.encoding or response.apparent_encoding}
+    save_cache_index(index, cache_dir)
+
+    return response.text, digest
+
+class ReplayRequestHandler(SimpleHTTPRequestHandler):
+    """Serves saved pages from a directory, adding an ETag to each file so clients can revalidate
+    with either If-None-Match or If-Modified-Since.
+    """
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+
+        self._etag = None
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            self._etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            if self.headers.get('If-None-Match') == self._etag:
+                self.send_response(304)
+                self.end_headers()
+                return None
+
+        return super().send_head()
+
+    def end_headers(self):
+        if getattr(self, '_etag', None):
+            self.send_header('ETag', self._etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_replay_server(directory, port=0):
+    """Starts a local HTTP server in a background thread that serves the files in directory.
+    Returns the server (call server.shutdown() to stop it) and its base URL.
+
+    Args:
+    directory -- folder of saved pages, e.g. commencement/index.html for the NPR page
+    port -- port to listen on; 0 picks a free one
+    """
+
+    handler = partial(ReplayRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}/'
@@ -0,0 +1,227 @@
+"""
+Lightweight instrumentation for the analysis stages. Instrumented functions and `span` blocks
+record their wall time, CPU time (including finished worker processes), peak resident memory and
+the number of rows going in and out; `count` keeps named counters such as scrape failures by
+reason. Everything is written to one JSON trace file, and each top-level stage can also be
+profiled with cProfile into its own .prof file.
+
+Instrumentation is off by default and then costs a single flag check per call. Turn it on with
+enable(), with `python cli.py --trace trace.json ...`, or by setting the SPEECH_TRACE environment
+variable to the trace path (and SPEECH_PROFILE_DIR to a folder for profiles).
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows - memory is then left out of the trace
+    resource = None
+
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux
+MAXRSS_PER_MB = 1024 ** 2 if sys.platform == 'darwin' else 1024
+
+TRACE_PATH = 'trace.json'
+
+_enabled = False
+_trace_path = TRACE_PATH
+_profile_dir = None
+_started = None
+_events = []
+_counters = defaultdict(Counter)
+_lock = threading.Lock()
+_local = threading.local()
+
+def enable(trace_path=TRACE_PATH, profile_dir=None):
+    """Starts recording. The trace is written to trace_path when disable() is called or the
+    process exits.
+
+    Args:
+    trace_path -- JSON file for the recorded spans and counters
+    profile_dir -- if given, each top-level span is profiled with cProfile and saved there as
+    <span name>.prof
+    """
+    global _enabled, _trace_path, _profile_dir, _started
+
+    if not _enabled:
+        atexit.register(disable)
+    _enabled = True
+    _trace_path = trace_path
+    _profile_dir = profile_dir
+    _started = time.perf_counter()
+    _events.clear()
+    _counters.clear()
+
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+def disable():
+    """Stops recording and writes the trace file. Returns the path of the trace, or None if
+    instrumentation wasn't enabled.
+    """
+    global _enabled
+
+    if not _enabled:
+        return None
+
+    _enabled = False
+    atexit.unregister(disable)
+
+    return write_trace(_trace_path)
+
+def is_enabled():
+    """Returns True while instrumentation is recording."""
+    return _enabled
+
+def write_trace(trace_path=TRACE_PATH):
+    """Writes the spans and counters recorded so far as JSON, replacing the file in a single
+    step. Returns the path of the trace.
+    """
+
+    with _lock:
+        trace = {'created': datetime.now().isoformat(timespec='seconds'),
+                 'pid': os.getpid(),
+                 'events': list(_events),
+                 'counters': {name: dict(counter) for name, counter in _counters.items()}}
+
+    with open(trace_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(trace, file, indent=1, default=str)
+    os.replace(trace_path + '.tmp', trace_path)
+
+    return trace_path
+
+def count(name, key='total', n=1):
+    """Adds n to the counter `key` in the counter group `name`, e.g.
+    count('scrape_failures', 'could not click').
+    """
+
+    if not _enabled:
+        return
+
+    with _lock:
+        _counters[name][key] += n
+
+def counters():
+    """Returns a copy of the counters recorded so far, as {name: {key: count}}."""
+
+    with _lock:
+        return {name: dict(counter) for name, counter in _counters.items()}
+
+def events():
+    """Returns a copy of the spans recorded so far."""
+
+    with _lock:
+        return list(_events)
+
+def n_rows(value):
+    """Returns the number of rows in a dataframe, array or list, or None for anything else."""
+
+    if isinstance(value, (str, bytes, dict)) or not hasattr(value, '__len__'):
+        return None
+
+    return len(value)
+
+def _usage():
+    """Returns (process CPU seconds, finished children CPU seconds, peak RSS in MB)."""
+
+    cpu = time.process_time()
+    if resource is None:
+        return cpu, None, None
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / MAXRSS_PER_MB
+
+    return cpu, children.ru_utime + children.ru_stime, peak_rss
+
+@contextmanager
+def span(name, rows_in=None):
+    """Records the block as one span of the trace. Yields the span's record, so the block can
+    set record['rows_out'] (or any other field). When instrumentation is disabled the block runs
+    with a throwaway record and nothing is measured.
+
+    Peak RSS is the process's high-water mark when the span ends; rss_growth_mb is how much the
+    span raised it, so a stage that pushed memory to a new peak shows a positive growth.
+    """
+
+    if not _enabled:
+        yield {}
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    record = {'name': name,
+              'parent': stack[-1] if stack else None,
+              'thread': threading.current_thread().name,
+              'start': round(time.perf_counter() - _started, 6),
+              'rows_in': rows_in}
+
+    # cProfile can't be nested, so only the outermost span on a thread is profiled
+    profiler = cProfile.Profile() if _profile_dir and not stack else None
+
+    stack.append(name)
+    cpu, child_cpu, peak_rss = _usage()
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = type(error).__name__
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall = time.perf_counter() - start
+        end_cpu, end_child_cpu, end_peak_rss = _usage()
+        stack.pop()
+
+        record.update({'wall_seconds': round(wall, 6),
+                       'cpu_seconds': round(end_cpu - cpu, 6)})
+        if end_peak_rss is not None:
+            record.update({'child_cpu_seconds': round(end_child_cpu - child_cpu, 6),
+                           'peak_rss_mb': round(end_peak_rss, 1),
+                           'rss_growth_mb': round(end_peak_rss - peak_rss, 1)})
+
+        if profiler is not None:
+            profile_path = os.path.join(_profile_dir, f'{name}.prof')
+            profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+
+        with _lock:
+            _events.append(record)
+
+def instrumented(func):
+    """Decorator that records every call of func as a span named <module>.<function>. Rows in
+    are counted from the first positional argument and rows out from the return value.
+    """
+
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        with span(name, n_rows(args[0]) if args else None) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = n_rows(result)
+            return result
+
+    return wrapper
+
+if os.environ.get('SPEECH_TRACE'):
+    enable(os.environ['SPEECH_TRACE'], os.environ.get('SPEECH_PROFILE_DIR'))
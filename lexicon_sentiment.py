@@ -0,0 +1,174 @@
+"""
+A vectorized approximation of VADER for scoring many speech sections or sliding windows at once.
+
+Every word is mapped to a token id, and the VADER lexicon, booster words and negations are looked
+up once per distinct word instead of once per occurrence. Each token's sentiment is computed with
+array operations over the id array. Section scores are then differences of cumulative sums, so
+scoring 10, 100 or thousands of overlapping windows per speech costs about the same.
+
+Rules covered: lexicon valences, booster/dampener words within three words before a sentiment
+word, negations within three words before it, the 'but' rule, and VADER's normalization into
+neg/neu/pos/compound. Idioms, 'least', 'kind of' and capitalization/punctuation emphasis are not
+modeled (the cleaned transcripts have no capitals or punctuation anyway). Booster and negation
+context is taken from the whole speech, so a word at the start of a section can be modified by
+the end of the previous one.
+"""
+
+import numpy as np
+import pandas as pd
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer, VaderConstants
+
+from Sentiment_Analysis import section_bounds, tokenize_speeches, window_bounds
+
+NORMALIZE_ALPHA = 15
+BOOSTER_DISTANCE_SCALES = ((1, 1.), (2, .95), (3, .9))
+
+def lexicon_arrays(vocabulary, analyser=None):
+    """Returns a dictionary of arrays aligned with vocabulary: the lexicon valence of each word (0
+    for booster words, as in VADER), whether it is in the lexicon, its booster increment, whether
+    it is a negation, and whether VADER would keep it as a word (longer than one character).
+    """
+
+    if analyser is None:
+        analyser = SentimentIntensityAnalyzer()
+    constants = VaderConstants()
+    lexicon = analyser.lexicon
+
+    return {'valence': np.array([0. if word in constants.BOOSTER_DICT else lexicon.get(word, 0.)
+                                 for word in vocabulary]),
+            'in_lexicon': np.array([word in lexicon for word in vocabulary], dtype=bool),
+            'booster': np.array([constants.BOOSTER_DICT.get(word, 0.) for word in vocabulary]),
+            'negation': np.array([word in constants.NEGATE or "n't" in word
+                                  for word in vocabulary], dtype=bool),
+            'is_word': np.array([len(word) > 1 for word in vocabulary], dtype=bool),
+            'is_but': np.array([word == 'but' for word in vocabulary], dtype=bool)}
+
+def token_sentiments(token_ids, speech_offsets, arrays):
+    """Returns the VADER-style sentiment of every token: its lexicon valence, pushed up or down by
+    booster words and flipped by negations among the three words before it in the same speech.
+
+    Args:
+    token_ids -- id of each word, all speeches concatenated
+    speech_offsets -- position of each speech's first word, plus the total word count
+    arrays -- the lexicon arrays for the token ids
+    """
+
+    n_tokens = len(token_ids)
+    position = np.arange(n_tokens) - np.repeat(speech_offsets[:-1], np.diff(speech_offsets))
+
+    valence = arrays['valence'][token_ids]
+    direction = np.sign(valence)
+    sentiment = valence.copy()
+    negations = np.zeros(n_tokens, dtype=np.int64)
+
+    for distance, scale in BOOSTER_DISTANCE_SCALES:
+        previous = np.zeros(n_tokens, dtype=token_ids.dtype)
+        previous[distance:] = token_ids[:-distance]
+
+        # like VADER, only words outside the lexicon can boost or negate the word after them
+        context = (position >= distance) & ~arrays['in_lexicon'][previous]
+        sentiment += np.where(context, arrays['booster'][previous] * scale * direction, 0.)
+        negations += context & arrays['negation'][previous]
+
+    n_scalar = VaderConstants.N_SCALAR
+    return np.where(valence != 0, sentiment * n_scalar ** negations, 0.)
+
+def segment_scores(sentiment, but_positions, starts, ends):
+    """Returns a dataframe with the neg, neu, pos and compound scores of each segment
+    [start, end) of the token sentiments, computed from cumulative sums.
+
+    Args:
+    sentiment -- per-token sentiment
+    but_positions -- sorted positions of the word 'but'
+    starts -- first token position of each segment
+    ends -- position one past the last token of each segment
+    """
+
+    def cumulative(values):
+        return np.concatenate(([0.], np.cumsum(values)))
+
+    def between(cumsum, first, last):
+        return cumsum[last] - cumsum[first]
+
+    positive = cumulative(np.where(sentiment > 0, sentiment, 0.))
+    negative = cumulative(np.where(sentiment < 0, sentiment, 0.))
+    n_positive = cumulative(sentiment > 0)
+    n_negative = cumulative(sentiment < 0)
+    n_neutral = cumulative(sentiment == 0)
+
+    # VADER halves sentiment before a segment's first 'but' and boosts it by half after it
+    if len(but_positions):
+        first_but = but_positions[np.minimum(np.searchsorted(but_positions, starts),
+                                              len(but_positions) - 1)]
+        has_but = (first_but >= starts) & (first_but < ends)
+    else:
+        first_but = ends
+        has_but = np.zeros(len(starts), dtype=bool)
+
+    before_end = np.where(has_but, first_but, ends)
+    after_start = np.where(has_but, first_but + 1, ends)
+    before_scale = np.where(has_but, .5, 1.)
+
+    pos_value = (before_scale * between(positive, starts, before_end)
+                 + 1.5 * between(positive, after_start, ends))
+    neg_value = (before_scale * between(negative, starts, before_end)
+                 + 1.5 * between(negative, after_start, ends))
+
+    total = pos_value + neg_value
+    compound = np.clip(total / np.sqrt(total * total + NORMALIZE_ALPHA), -1, 1)
+
+    pos_sum = pos_value + between(n_positive, starts, ends)
+    neg_sum = np.abs(neg_value - between(n_negative, starts, ends))
+    neu_count = between(n_neutral, starts, ends)
+    denominator = pos_sum + neg_sum + neu_count
+    safe_denominator = np.where(denominator > 0, denominator, 1)
+
+    return pd.DataFrame({'neg': np.round(neg_sum / safe_denominator, 3),
+                         'neu': np.round(neu_count / safe_denominator, 3),
+                         'pos': np.round(pos_sum / safe_denominator, 3),
+                         'compound': np.round(compound, 4)})
+
+def score_sections(data, n_sections=10, window=None, overlap=0, analyser=None):
+    """Returns a long dataframe with the approximate VADER neg, neu, pos and compound scores of
+    each section of each speech: n_sections equal parts, cut the same way as split_speeches, or
+    sliding windows of `window` words overlapping by `overlap`.
+
+    Args:
+    data -- dataframe with cleaned transcripts in a 'speech' column
+    n_sections -- number of equal sections per speech
+    window -- if given, score sliding windows of this many words instead
+    overlap -- words shared by consecutive windows
+    analyser -- SentimentIntensityAnalyzer whose lexicon is used
+    """
+
+    tokens, offsets = tokenize_speeches(data.speech)
+    lengths = np.diff(offsets)
+
+    if window is None:
+        starts, ends = section_bounds(lengths, n_sections)
+        speech_numbers = np.repeat(np.arange(len(lengths)), n_sections)
+        section_numbers = np.tile(np.arange(n_sections), len(lengths))
+        starts, ends = starts.ravel(), ends.ravel()
+    else:
+        speech_numbers, section_numbers, starts, ends = window_bounds(lengths, window, overlap)
+
+    token_ids, vocabulary = pd.factorize(np.array(tokens, dtype=object))
+    arrays = lexicon_arrays(vocabulary, analyser)
+
+    # VADER ignores one-character tokens - drop them and move every boundary accordingly
+    is_word = arrays['is_word'][token_ids]
+    kept_before = np.concatenate(([0], np.cumsum(is_word)))
+    first_word = offsets[speech_numbers]
+    starts = kept_before[first_word + starts]
+    ends = kept_before[first_word + ends]
+    token_ids = token_ids[is_word]
+
+    sentiment = token_sentiments(token_ids, kept_before[offsets], arrays)
+    but_positions = np.flatnonzero(arrays['is_but'][token_ids])
+
+    scores = segment_scores(sentiment, but_positions, starts, ends)
+    scores.insert(0, 'speech_id', data.index[speech_numbers])
+    scores.insert(1, 'section', section_numbers)
+
+    return scores
@@ -0,0 +1,163 @@
+"""
+Shared MongoDB access for the commencement speeches: one pooled client per process, a batched,
+idempotent bulk loader keyed on the speaker name, school, and year, and a chunked reader that
+streams speeches back out as small dataframes.
+"""
+
+from time import perf_counter
+
+import pandas as pd
+
+DATABASE = 'speeches'
+COLLECTION = 'speech_collection'
+SPEECH_FIELDS = ['name', 'school', 'year', 'speech']
+SPEECH_KEY = ['name', 'school', 'year']
+
+_client = None
+
+def get_mongo_client(**client_options):
+    """Returns the MongoClient shared by the whole process, creating it on first use. A client
+    keeps its own connection pool, so reusing it avoids reconnecting for every read or write.
+    """
+    global _client
+
+    if _client is None:
+        from pymongo import MongoClient
+        _client = MongoClient(**client_options)
+
+    return _client
+
+def get_speech_collection(client=None):
+    """Returns the collection that stores the raw commencement speeches."""
+
+    if client is None:
+        client = get_mongo_client()
+
+    return client[DATABASE][COLLECTION]
+
+def find_duplicate_speeches(collection):
+    """Returns a list of (name, school, year) keys stored more than once, each with the ids of
+    its documents in collection order.
+    """
+
+    group_key = {field: f'${field}' for field in SPEECH_KEY}
+    duplicates = collection.aggregate([
+        {'$group': {'_id': group_key, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}])
+
+    return [(tuple(group['_id'][field] for field in SPEECH_KEY), group['ids'])
+            for group in duplicates]
+
+def remove_duplicate_speeches(collection):
+    """Deletes all but the first stored copy of each (name, school, year) speech, even if the
+    copies hold different transcripts. Returns the number of documents removed.
+
+    This is a separate, explicit cleanup step (python cli.py remove-duplicates) and is never run
+    by an upload. The gender designations in m_f_designation.pkl are matched to the cleaned
+    speeches by position, so they have to be regenerated after documents are removed.
+    """
+
+    extra_ids = [doc_id for _, ids in find_duplicate_speeches(collection) for doc_id in ids[1:]]
+    if extra_ids:
+        collection.delete_many({'_id': {'$in': extra_ids}})
+
+    return len(extra_ids)
+
+def ensure_speech_index(collection):
+    """Creates the unique (name, school, year) index. Raises a ValueError if the collection was
+    loaded before the index existed and holds duplicates; nothing is deleted here.
+    """
+
+    from pymongo import ASCENDING
+    from pymongo.errors import OperationFailure
+
+    keys = [(field, ASCENDING) for field in SPEECH_KEY]
+
+    try:
+        collection.create_index(keys, unique=True, name='speech_key')
+    except OperationFailure:
+        duplicates = find_duplicate_speeches(collection)
+        if not duplicates:
+            raise
+
+        examples = ', '.join(str(key) for key, _ in duplicates[:3])
+        raise ValueError(f"{len(duplicates)} speeches are stored more than once (e.g. {examples}), "
+                         "so the unique index can't be created. Review them and remove the extra "
+                         "copies with 'python cli.py remove-duplicates', then regenerate "
+                         "m_f_designation.pkl, which matches genders to speeches by position.")
+
+def bulk_upsert_speeches(speeches, collection=None, batch_size=100):
+    """Upserts speeches into MongoDB in batches and returns the number of speeches written.
+    Loading the same speech twice updates the stored copy instead of adding a duplicate.
+    Prints the load rate in docs/sec.
+
+    Args:
+    speeches -- iterable of [name, school, year, speech] lists; failure messages are skipped
+    collection -- collection to write to, e.g. a mongomock collection; defaults to the shared client
+    batch_size -- number of upserts sent per bulk_write call
+    """
+
+    from pymongo import UpdateOne
+
+    if collection is None:
+        collection = get_speech_collection()
+    ensure_speech_index(collection)
+
+    start = perf_counter()
+    n_docs = n_skipped = 0
+    batch = []
+
+    for speech in speeches:
+        # scrape failures are recorded as a message rather than a list - nothing to store
+        if not isinstance(speech, (list, tuple)):
+            n_skipped += 1
+            continue
+
+        speech_dict = dict(zip(SPEECH_FIELDS, speech))
+        key = {field: speech_dict[field] for field in SPEECH_KEY}
+        batch.append(UpdateOne(key, {'$set': speech_dict}, upsert=True))
+
+        if len(batch) >= batch_size:
+            collection.bulk_write(batch, ordered=False)
+            n_docs += len(batch)
+            batch = []
+
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+        n_docs += len(batch)
+
+    elapsed = perf_counter() - start
+    rate = n_docs / elapsed if elapsed else 0
+    print(f"Upserted {n_docs} speeches in {elapsed:.2f}s ({rate:.0f} docs/sec)")
+    if n_skipped:
+        print(f"Skipped {n_skipped} scrape failures - m_f_designation.pkl must list one gender "
+              "per stored speech, in collection order")
+
+    return n_docs
+
+def iter_speech_chunks(collection=None, chunk_size=100, fields=SPEECH_FIELDS):
+    """Yields dataframes of at most chunk_size speeches, in collection order. Only the requested
+    fields are fetched (never '_id'), and only one chunk is held in memory at a time.
+
+    Args:
+    collection -- collection to read from; defaults to the shared client's speech collection
+    chunk_size -- number of speeches per dataframe, also used as the cursor batch size
+    fields -- fields to project from each document
+    """
+
+    if collection is None:
+        collection = get_speech_collection()
+
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+    cursor = collection.find({}, projection, batch_size=chunk_size)
+
+    records = []
+    for record in cursor:
+        records.append(record)
+        if len(records) == chunk_size:
+            yield pd.DataFrame.from_records(records, columns=fields)
+            records = []
+
+    if records:
+        yield pd.DataFrame.from_records(records, columns=fields)
@@ -0,0 +1,252 @@
+"""
+Near-duplicate detection for speech transcripts. The same speech scraped from two YouTube uploads
+has slightly different auto-captions, so it survives exact duplicate removal. Each transcript is
+reduced to the set of its word shingles (runs of consecutive words), summarized by a MinHash
+signature, and indexed with locality sensitive hashing (LSH): signatures are cut into bands, and
+only speeches that share a band are compared. Finding duplicates therefore never compares all
+pairs, and a new speech is checked against the index in about constant time.
+
+Speeches whose estimated shingle similarity (Jaccard) reaches the threshold are joined into one
+cluster; the first speech inserted stays the canonical one.
+"""
+
+import hashlib
+import os
+import pickle
+
+from functools import lru_cache
+
+import numpy as np
+
+INDEX_PATH = 'near_duplicate_index.pkl'
+
+# odd 64 bit constant used to combine word hashes into shingle hashes
+SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+@lru_cache(maxsize=1 << 20)
+def word_hash(word):
+    """Returns a 64 bit hash of a word."""
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def shingle_hashes(text, shingle_size=5):
+    """Returns the distinct 64 bit hashes of the text's shingles of shingle_size consecutive
+    words. Texts shorter than a shingle give a single shingle of all their words; empty texts
+    give none.
+    """
+
+    words = text.split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+
+    hashes = np.fromiter((word_hash(word) for word in words), dtype=np.uint64, count=len(words))
+    n_shingles = max(len(words) - shingle_size + 1, 1)
+    shingle_size = min(shingle_size, len(words))
+
+    # polynomial hash of each window of words; uint64 arithmetic wraps around
+    shingles = np.zeros(n_shingles, dtype=np.uint64)
+    for offset in range(shingle_size):
+        shingles = shingles * SHINGLE_MULTIPLIER + hashes[offset:offset + n_shingles]
+
+    return np.unique(shingles)
+
+class UnionFind:
+    """Disjoint sets of keys. The root of each set is the key that was added first."""
+
+    def __init__(self):
+        self.parent = {}
+        self.order = {}
+
+    def add(self, key):
+        if key not in self.parent:
+            self.parent[key] = key
+            self.order[key] = len(self.order)
+
+    def find(self, key):
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        # point every key on the path straight at the root
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+
+        return root
+
+    def union(self, key, other):
+        root, other_root = self.find(key), self.find(other)
+        if root == other_root:
+            return root
+
+        if self.order[other_root] < self.order[root]:
+            root, other_root = other_root, root
+        self.parent[other_root] = root
+
+        return root
+
+class NearDuplicateIndex:
+    """MinHash LSH index of speech transcripts.
+
+    Args:
+    threshold -- estimated Jaccard similarity of the shingle sets at which two speeches count as
+    near-duplicates
+    bands -- number of LSH bands
+    rows -- signature values per band; bands * rows MinHash functions are used. Pairs below
+    roughly (1 / bands) ** (1 / rows) similarity (about .71 for the defaults) are rarely compared
+    shingle_size -- words per shingle
+    seed -- random seed of the MinHash functions
+    """
+
+    def __init__(self, threshold=.8, bands=16, rows=8, shingle_size=5, seed=19):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+
+        # multiply-shift hash functions: (a * x + b) >> 32 with odd a
+        rng = np.random.default_rng(seed)
+        n_hashes = bands * rows
+        self.multipliers = rng.integers(0, 2 ** 63, n_hashes, dtype=np.uint64) * 2 + 1
+        self.offsets = rng.integers(0, 2 ** 63, n_hashes, dtype=np.uint64)
+
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+        self.clusters = UnionFind()
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        """Returns the MinHash signature of a text, or None if it has no words."""
+
+        shingles = shingle_hashes(text, self.shingle_size)
+        if not len(shingles):
+            return None
+
+        hashed = (self.multipliers[:, None] * shingles[None, :] + self.offsets[:, None]) >> 32
+        return hashed.min(axis=1)
+
+    def band_keys(self, signature):
+        """Returns the bucket key of each band of a signature."""
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def matches(self, signature):
+        """Returns a list of (key, estimated similarity) of the indexed speeches that share a
+        band with the signature and reach the threshold, most similar first.
+        """
+
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+
+        similar = []
+        for key in candidates:
+            similarity = float(np.mean(self.signatures[key] == signature))
+            if similarity >= self.threshold:
+                similar.append((key, similarity))
+
+        return sorted(similar, key=lambda match: match[1], reverse=True)
+
+    def query(self, text):
+        """Returns a list of (key, estimated similarity) of the indexed near-duplicates of a
+        text, most similar first, without adding the text to the index.
+        """
+
+        signature = self.signature(text)
+        return [] if signature is None else self.matches(signature)
+
+    def insert(self, key, text):
+        """Adds a speech to the index and returns the canonical key of its cluster: its own key
+        if it has no near-duplicate in the index, otherwise the key of the first indexed speech
+        it is a near-duplicate of (directly or through other near-duplicates).
+        """
+
+        if key in self.signatures:
+            return self.clusters.find(key)
+
+        signature = self.signature(text)
+        if signature is None:
+            return key
+
+        self.clusters.add(key)
+        for match, _ in self.matches(signature):
+            self.clusters.union(match, key)
+
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+        return self.clusters.find(key)
+
+    def canonical(self, key):
+        """Returns the canonical key of the cluster an indexed speech belongs to."""
+        return self.clusters.find(key) if key in self.signatures else key
+
+    def duplicate_clusters(self):
+        """Returns a dictionary mapping each canonical key with near-duplicates to the keys of
+        its whole cluster, in insertion order.
+        """
+
+        clusters = {}
+        for key in self.signatures:
+            clusters.setdefault(self.clusters.find(key), []).append(key)
+
+        return {root: keys for root, keys in clusters.items() if len(keys) > 1}
+
+def find_near_duplicates(keys, texts, index=None):
+    """Inserts each text into the index in order and returns a boolean array that is True for
+    the texts that are near-duplicates of an earlier one, i.e. not the canonical speech of their
+    cluster.
+
+    Args:
+    keys -- a unique key for each text
+    texts -- transcripts to check
+    index -- NearDuplicateIndex to check against and add to; a new one is used if not given
+    """
+
+    if index is None:
+        index = NearDuplicateIndex()
+
+    return np.array([index.insert(key, text) != key for key, text in zip(keys, texts)],
+                    dtype=bool)
+
+def known_near_duplicates(speeches, index):
+    """Returns a list of (speech, canonical key, estimated similarity) for the new speeches that
+    are near-duplicates of a differently keyed speech in the index, without adding them to it.
+    Transcripts are cleaned first, since the index holds cleaned text.
+
+    Args:
+    speeches -- iterable of [name, school, year, speech] lists; failure messages are skipped
+    index -- NearDuplicateIndex of the cleaned speeches, e.g. from load_index()
+    """
+    from text_cleaning import clean_text
+
+    found = []
+    for speech in speeches:
+        if not isinstance(speech, (list, tuple)):
+            continue
+
+        matches = index.query(clean_text(speech[3]))
+
+        # a speech uploaded again matches its own indexed copy (and that copy's near-duplicates)
+        if matches and all(tuple(key[:3]) != tuple(speech[:3]) for key, _ in matches):
+            key, similarity = matches[0]
+            found.append((speech, index.canonical(key), similarity))
+
+    return found
+
+def save_index(index, index_path=INDEX_PATH):
+    """Pickles the index, replacing the saved one in a single step."""
+
+    with open(index_path + '.tmp', 'wb') as file:
+        pickle.dump(index, file)
+    os.replace(index_path + '.tmp', index_path)
+
+def load_index(index_path=INDEX_PATH):
+    """Returns the saved index, or a new empty one if there isn't one."""
+
+    if not os.path.exists(index_path):
+        return NearDuplicateIndex()
+
+    with open(index_path, 'rb') as file:
+        return pickle.load(file)
@@ -0,0 +1,217 @@
+"""
+Runs the analysis stages in order (scrape, clean, topic model, sentiment, gender aggregates) and
+skips any stage whose outputs are already up to date.
+
+Each stage declares its input files, output files, the modules its code lives in, and the
+parameters it depends on (such as the stop word list and NMF settings). A stage's fingerprint is
+a hash of all of these, where the modules also cover every local module they import, directly
+or not; the stage is skipped when its fingerprint matches the one recorded on its
+last successful run and its outputs still exist. Outputs are hashed by content, so re-running a
+stage that produces identical output does not force the stages after it to run again.
+"""
+
+import ast
+import hashlib
+import json
+import os
+
+from collections import namedtuple
+
+from instrumentation import span
+
+STATE_PATH = '.pipeline_state.json'
+
+Stage = namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'modules', 'params'])
+
+def run_scrape():
+    """Scrapes the speech list and transcripts and uploads them to MongoDB."""
+    import web_scraping_npr_youtube
+    web_scraping_npr_youtube.main()
+
+def run_clean():
+    """Cleans the speeches stored in MongoDB."""
+    import data_preprocessing
+    data_preprocessing.main()
+
+def run_topic_model():
+    """Fits the topic model on the cleaned speeches."""
+    from artifact_store import read_artifact
+    from topic_modeling import topic_modeling
+
+    topic_modeling(read_artifact('cleaned_speeches'))
+
+def run_sentiment():
+    """Scores the sentiment of each section of the speeches."""
+    from artifact_store import read_artifact
+    from Sentiment_Analysis import obtain_comp_score, split_speeches
+
+    # every column, so the topic weights are carried into the sentiment output
+    model_output = read_artifact('topic_modeling_output')
+    obtain_comp_score(split_speeches(model_output))
+
+def run_gender_aggregates():
+    """Compares topics and sentiment between male and female speakers."""
+    from aggregate_cube import update_sentiment_cube
+    from artifact_store import artifact_path, read_artifact
+    from Sentiment_Analysis import sentiment_by_gender
+    from topic_modeling import compare_genders
+
+    compare_genders(read_artifact('topic_modeling_output', columns=['gender', 'top_topic']))
+
+    sentiment_data = read_artifact('overall_sentiment_analysis')
+    cube = update_sentiment_cube(sentiment_data, source_hash=file_hash(
+        artifact_path('overall_sentiment_analysis')))
+    sentiment_by_gender(sentiment_data, cube=cube)
+
+def topic_model_params():
+    """Returns the settings that determine the topic model's output."""
+    from topic_modeling import NMF_PARAMS, TOPIC_COLUMNS, VECTORIZER_PARAMS, new_stopwords
+
+    return {'stop_words': sorted(new_stopwords()), 'vectorizer': VECTORIZER_PARAMS,
+            'nmf': NMF_PARAMS, 'topic_columns': TOPIC_COLUMNS}
+
+STAGES = [
+    Stage('scrape', run_scrape,
+          inputs=[],
+          outputs=['scraped_content.pkl'],
+          modules=['web_scraping_npr_youtube.py', 'http_cache.py', 'mongo_store.py'],
+          params=lambda: {}),
+    Stage('clean', run_clean,
+          inputs=['scraped_content.pkl', 'manual_speeches.pkl', 'm_f_designation.pkl'],
+          outputs=['artifacts/speeches_df_basic_cleaning.parquet',
+                   'artifacts/cleaned_speeches.parquet', 'near_duplicate_index.pkl'],
+          modules=['data_preprocessing.py', 'text_cleaning.py', 'mongo_store.py',
+                   'near_duplicates.py'],
+          params=lambda: {}),
+    Stage('topic_model', run_topic_model,
+          inputs=['artifacts/cleaned_speeches.parquet'],
+          outputs=['artifacts/topic_modeling_output.parquet'],
+          modules=['topic_modeling.py', 'stop_words.py', 'search_index.py'],
+          params=topic_model_params),
+    Stage('sentiment', run_sentiment,
+          inputs=['artifacts/topic_modeling_output.parquet'],
+          outputs=['artifacts/overall_sentiment_analysis.parquet'],
+          modules=['Sentiment_Analysis.py', 'vader_scoring.py', 'stop_words.py'],
+          params=lambda: {'n_sections': 10}),
+    Stage('gender_aggregates', run_gender_aggregates,
+          inputs=['artifacts/topic_modeling_output.parquet',
+                  'artifacts/overall_sentiment_analysis.parquet'],
+          outputs=['topic_distro_gender.csv', 'mean_sentiment_per_gender.csv',
+                   'aggregates/sentiment_cube.pkl'],
+          modules=['topic_modeling.py', 'Sentiment_Analysis.py', 'aggregate_cube.py'],
+          params=lambda: {}),
+]
+
+def file_hash(path):
+    """Returns the SHA-256 of a file's content, or 'missing' if the file doesn't exist."""
+
+    if not os.path.exists(path):
+        return 'missing'
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def imported_modules(path):
+    """Returns the names of the modules a Python file imports, including imports made inside
+    functions.
+    """
+
+    with open(path, encoding='utf-8') as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+
+    return names
+
+def local_modules(paths):
+    """Returns the given module files and every module file next to them that they import,
+    directly or through other local modules, sorted.
+    """
+
+    found, pending = set(), list(paths)
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.exists(path):
+            continue
+        found.add(path)
+
+        directory = os.path.dirname(path)
+        pending.extend(os.path.join(directory, name + '.py') for name in imported_modules(path))
+
+    return sorted(found.union(paths))
+
+def stage_fingerprint(stage):
+    """Returns a hash of everything that determines a stage's outputs: the content of its input
+    files, its code modules and the local modules they import, and its parameters.
+    """
+
+    description = {'stage': stage.name,
+                   'inputs': {path: file_hash(path) for path in stage.inputs},
+                   'modules': {path: file_hash(path) for path in local_modules(stage.modules)},
+                   'params': stage.params()}
+    encoded = json.dumps(description, sort_keys=True, default=str).encode('utf-8')
+
+    return hashlib.sha256(encoded).hexdigest()
+
+def load_state(state_path=STATE_PATH):
+    """Returns the fingerprint recorded for each stage on its last successful run."""
+
+    if not os.path.exists(state_path):
+        return {}
+
+    with open(state_path, encoding='utf-8') as file:
+        return json.load(file)
+
+def save_state(state, state_path=STATE_PATH):
+    """Writes the recorded stage fingerprints to disk, replacing the old file in a single step."""
+
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=1)
+    os.replace(state_path + '.tmp', state_path)
+
+def run_pipeline(only=None, force=False, adopt=False, state_path=STATE_PATH):
+    """Runs the pipeline stages in order, skipping those that are up to date. Returns the names of
+    the stages that ran.
+
+    Args:
+    only -- names of the stages to consider; None considers all of them
+    force -- run the considered stages even if they are up to date
+    adopt -- record stages whose outputs already exist as up to date without running them, e.g.
+    for outputs produced before the pipeline runner existed
+    state_path -- file holding the recorded fingerprints
+    """
+
+    state = load_state(state_path)
+    ran = []
+
+    for stage in STAGES:
+        if only is not None and stage.name not in only:
+            continue
+
+        fingerprint = stage_fingerprint(stage)
+        outputs_exist = all(os.path.exists(path) for path in stage.outputs)
+
+        if not force and outputs_exist and (adopt or state.get(stage.name) == fingerprint):
+            print(f"{stage.name}: up to date")
+        else:
+            print(f"{stage.name}: running")
+            with span(f'pipeline.{stage.name}'):
+                stage.run()
+            ran.append(stage.name)
+
+        state[stage.name] = fingerprint
+        save_state(state, state_path)
+
+    return ran
+
+if __name__ == '__main__':
+    run_pipeline()
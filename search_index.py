@@ -0,0 +1,298 @@
+"""
+A search index over the topic modeled speeches, built whenever the topic modeling output is
+written and saved next to the model version that produced it. It answers two kinds of questions
+without rescanning the output files:
+
+* which speeches are most like a given speech (or text): nearest neighbours by cosine similarity
+  of the normalized NMF topic weights and TF-IDF vectors
+* which speeches use some terms: an inverted index of every lemmatized term, with filters on top
+  topic, gender and year, ranked by term count or by the weight of a chosen topic
+"""
+
+import os
+import pickle
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from artifact_store import iter_artifact_batches
+from instrumentation import instrumented
+from stop_words import new_stopwords
+from topic_modeling import MODEL_DIR, create_lemmatized_words, lemmatize_tokens, \
+    load_topic_model, output_model_version, top_k_indices, unit_rows
+
+METADATA_COLUMNS = ['name', 'school', 'year', 'gender', 'top_topic']
+
+def search_index_path(version, model_dir=MODEL_DIR):
+    """Returns the file path of the search index built from a topic model version."""
+    return os.path.join(model_dir, f'search_index_v{version}.pkl')
+
+class SearchIndex:
+    """Nearest neighbour and term search over the modeled speeches. Documents are referred to by
+    their row position in the topic modeling output.
+
+    Args:
+    metadata -- dataframe with the name, school, year, gender and top topic of each speech
+    doc_topic -- topic weights of each speech, one column per topic
+    tfidf -- sparse TF-IDF rows of the speeches, from the model's vectorizer
+    term_counts -- sparse (speeches x terms) counts of every lemmatized term
+    vocabulary -- dictionary mapping each term to its column in term_counts
+    artifact -- the topic model artifact the index was built from
+    """
+
+    def __init__(self, metadata, doc_topic, tfidf, term_counts, vocabulary, artifact):
+        self.metadata = metadata.reset_index(drop=True)
+        self.topic_columns = list(artifact['topic_columns'])
+        self.model_version = artifact['version']
+        self.vectorizer = artifact['vectorizer']
+        self.model = artifact['model']
+
+        self.doc_topic = np.asarray(doc_topic, dtype=np.float32)
+        self.topic_vectors = unit_rows(self.doc_topic)
+        self.tfidf = tfidf.tocsr().astype(np.float32)
+
+        # column j of a CSC matrix is the posting list of term j
+        self.postings = term_counts.tocsc()
+        self.vocabulary = vocabulary
+
+        self.years = pd.to_numeric(self.metadata.year, errors='coerce').to_numpy()
+        self.genders = self.metadata.gender.astype(str).to_numpy()
+        self.top_topics = self.metadata.top_topic.astype(str).to_numpy()
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def locate(self, name):
+        """Returns the positions of the speeches whose speaker name contains the given text."""
+        return np.flatnonzero(self.metadata.name.str.contains(name, case=False, regex=False))
+
+    def filter_mask(self, top_topic=None, gender=None, years=None):
+        """Returns a boolean array of the speeches that pass the filters, or None if no filter
+        is given.
+
+        Args:
+        top_topic -- keep speeches with this top topic
+        gender -- keep speeches with this gender designation ('1' female, '0' male)
+        years -- keep speeches from this year, or from a (first, last) range of years
+        """
+
+        mask = None
+
+        def narrow(keep):
+            return keep if mask is None else mask & keep
+
+        if top_topic is not None:
+            mask = narrow(self.top_topics == str(top_topic))
+        if gender is not None:
+            mask = narrow(self.genders == str(gender))
+        if years is not None:
+            if not isinstance(years, (tuple, list)):
+                years = (years,)
+            first, last = years[0], years[-1]
+            mask = narrow((self.years >= int(first)) & (self.years <= int(last)))
+
+        return mask
+
+    def results(self, positions, scores, score_name):
+        """Returns the metadata of the given speeches with their scores, in the given order."""
+
+        found = self.metadata.iloc[positions].copy()
+        found.insert(0, 'position', positions)
+        found[score_name] = scores
+        return found.reset_index(drop=True)
+
+    def nearest(self, topic_vector, tfidf_vector, k, topic_weight, exclude=None, **filters):
+        """Returns the k speeches with the highest blend of topic and TF-IDF cosine similarity
+        to the given normalized vectors.
+        """
+
+        similarity = (topic_weight * (self.topic_vectors @ topic_vector)
+                      + (1 - topic_weight) * (self.tfidf @ tfidf_vector.T).toarray().ravel())
+
+        mask = self.filter_mask(**filters)
+        if mask is not None:
+            similarity = np.where(mask, similarity, -np.inf)
+        if exclude is not None:
+            similarity[exclude] = -np.inf
+
+        top = top_k_indices(similarity, k)
+        top = top[np.isfinite(similarity[top])]
+
+        return self.results(top, similarity[top], 'similarity')
+
+    @instrumented
+    def similar(self, position, k=10, topic_weight=.5, **filters):
+        """Returns the k speeches most similar to the speech at the given position, most similar
+        first.
+
+        Args:
+        position -- row position of the speech, e.g. from locate()
+        k -- number of speeches to return
+        topic_weight -- share of the similarity given by the topic weights; the rest comes from
+        the TF-IDF vectors
+        filters -- top_topic, gender and years filters, as in filter_mask
+        """
+
+        return self.nearest(self.topic_vectors[position], self.tfidf[position], k, topic_weight,
+                            exclude=position, **filters)
+
+    @instrumented
+    def similar_to_text(self, text, k=10, topic_weight=.5, **filters):
+        """Returns the k speeches most similar to a cleaned transcript that isn't in the index,
+        most similar first. The text is vectorized and assigned topics with the saved model.
+        """
+
+        lemmatized_df = create_lemmatized_words(pd.DataFrame({'speech': [text]}))
+        tfidf_vector = self.vectorizer.transform(lemmatized_df.lemmatized_words)
+        topic_vector = unit_rows(self.model.transform(tfidf_vector))[0]
+
+        return self.nearest(topic_vector, tfidf_vector, k, topic_weight, **filters)
+
+    def term_positions(self, term):
+        """Returns the positions of the speeches that use a term (lemmatized like the
+        transcripts), and how often each uses it.
+        """
+
+        lemma = ' '.join(lemmatize_tokens(term.lower().split()))
+        column = self.vocabulary.get(lemma)
+        if column is None:
+            return np.array([], dtype=int), np.array([], dtype=int)
+
+        start, end = self.postings.indptr[column], self.postings.indptr[column + 1]
+        return self.postings.indices[start:end], self.postings.data[start:end]
+
+    @instrumented
+    def search(self, terms, k=10, rank_by=None, **filters):
+        """Returns up to k speeches that use every one of the terms and pass the filters.
+
+        Args:
+        terms -- a term or list of terms; each is lemmatized before lookup
+        k -- number of speeches to return
+        rank_by -- a topic name to rank by that topic's weight, e.g. 'career'; by default
+        speeches are ranked by how often they use the terms
+        filters -- top_topic, gender and years filters, as in filter_mask
+        """
+
+        if isinstance(terms, str):
+            terms = [terms]
+
+        positions, counts = None, None
+        for term in terms:
+            term_docs, term_counts = self.term_positions(term)
+            if positions is None:
+                positions, counts = term_docs, term_counts.astype(np.int64)
+            else:
+                positions, keep, keep_term = np.intersect1d(positions, term_docs,
+                                                            assume_unique=True,
+                                                            return_indices=True)
+                counts = counts[keep] + term_counts[keep_term]
+
+        if positions is None or not len(positions):
+            return self.results(np.array([], dtype=int), [], 'score')
+
+        mask = self.filter_mask(**filters)
+        if mask is not None:
+            keep = mask[positions]
+            positions, counts = positions[keep], counts[keep]
+
+        if rank_by is None:
+            scores = counts.astype(float)
+        else:
+            scores = self.doc_topic[positions, self.topic_columns.index(rank_by)]
+
+        top = top_k_indices(scores, k)
+        return self.results(positions[top], scores[top], 'score')
+
+@instrumented
+def build_search_index(version=None, model_dir=MODEL_DIR,
+                       speeches_artifact='topic_modeling_output', batch_size=1000):
+    """Returns a search index over the topic modeling output, built one batch of speeches at a
+    time with the vectorizer of the model version that produced the output. Raises a ValueError
+    if another version is asked for, since its vectorizer doesn't match the output's topic
+    weights.
+
+    Args:
+    version -- topic model version whose vectorizer and topics are used; defaults to the one
+    recorded with the output
+    model_dir -- directory holding the versioned model artifacts
+    speeches_artifact -- artifact with the topic modeling output, including the 'speech' column
+    batch_size -- speeches read and vectorized at a time
+    """
+    from scipy import sparse
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    output_version = output_model_version(speeches_artifact)
+    if output_version is None:
+        raise ValueError(f"'{speeches_artifact}' doesn't record the topic model version that "
+                         "produced it - run topic modeling again before building the index")
+    if version is not None and version != output_version:
+        raise ValueError(f"'{speeches_artifact}' was produced by topic model version "
+                         f"{output_version}, not version {version}")
+
+    artifact = load_topic_model(output_version, model_dir)
+    topic_columns = artifact['topic_columns']
+    analyze = CountVectorizer(stop_words=sorted(new_stopwords())).build_analyzer()
+
+    metadata, doc_topic, tfidf = [], [], []
+    vocabulary = {}
+    indptr, indices, counts = [0], [], []
+
+    for batch in iter_artifact_batches(speeches_artifact, batch_size):
+        metadata.append(batch[[col for col in METADATA_COLUMNS if col in batch.columns]])
+        doc_topic.append(batch[topic_columns].to_numpy(dtype=np.float32))
+
+        lemmatized_df = create_lemmatized_words(batch)
+        tfidf.append(artifact['vectorizer'].transform(lemmatized_df.lemmatized_words))
+
+        for text in lemmatized_df.lemmatized_words:
+            term_counts = Counter(vocabulary.setdefault(term, len(vocabulary))
+                                  for term in analyze(text))
+            indices.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+            indptr.append(len(indices))
+
+    term_counts = sparse.csr_matrix((np.array(counts, dtype=np.int32),
+                                     np.array(indices, dtype=np.int64), np.array(indptr)),
+                                    shape=(len(indptr) - 1, len(vocabulary)))
+
+    return SearchIndex(pd.concat(metadata, ignore_index=True), np.vstack(doc_topic),
+                       sparse.vstack(tfidf), term_counts, vocabulary, artifact)
+
+def save_search_index(index, model_dir=MODEL_DIR):
+    """Pickles the index next to the model version it was built from. Returns its path."""
+
+    path = search_index_path(index.model_version, model_dir)
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump(index, file)
+    os.replace(path + '.tmp', path)
+
+    print(f"Saved search index for topic model version {index.model_version} to {path}")
+    return path
+
+def update_search_index(model_dir=MODEL_DIR):
+    """Builds the search index over the current topic modeling output and saves it next to the
+    model version that produced it. Returns the index.
+    """
+
+    index = build_search_index(model_dir=model_dir)
+    save_search_index(index, model_dir)
+
+    return index
+
+def load_search_index(version=None, model_dir=MODEL_DIR):
+    """Returns the saved search index of a topic model version, by default the version that
+    produced the current topic modeling output.
+    """
+
+    if version is None:
+        version = output_model_version()
+
+    path = search_index_path(version, model_dir)
+    if version is None or not os.path.exists(path):
+        raise FileNotFoundError(f"No search index for topic model version {version} in "
+                                f"{model_dir} - build one with 'python cli.py search --build'")
+
+    with open(path, 'rb') as file:
+        return pickle.load(file)
@@ -0,0 +1,51 @@
+"""
+The stop words removed before topic modeling and top word counts: the standard english stop
+words joined with a custom list of words that are common in commencement speeches but say nothing
+about their topics.
+"""
+
+from functools import lru_cache
+
+CUSTOM_STOP_WORDS = frozenset(['like', 'know', 'im', 'just', 'thank', 'dont', 'youre', 'get',
+                               'would', 'said', 'thats', 'think', 'say', 'things', 'us', 'going',
+                               'way', 'really', 'well', 'many', 'got', 'right', 'something',
+                               'thing', 'didnt', 'wa', 'one', 'went', 'wanted', 'ha', 'one', 'lot',
+                               'mean', 'want', 'congratulations', 'commencement', 'staff',
+                               'speaker', 'trustees', 'board', 'members', 'everything', 'guy',
+                               'someone', 'everyone', 'ive', 'actually', 'theyre', 'youll', 'come',
+                               'dr', 'anything', 'new', 'also', 'says', 'must', 'though', 'even',
+                               'today', 'kind', 'hes', 'stuff', 'somebody', 'gon', 'york', 'day',
+                               'women', 'men', 'woman', 'man', 'lets', 'id', 'guys', 'let', 'tell',
+                               'cant', 'thought', 'great', 'look', 'always', 'cant', 'big', 'see',
+                               'take', 'never', 'back', 'little', 'need', 'maybe', 'every', 'still',
+                               'ever', 'two', 'around', 'honor', 'three', 'please', 'called', 'may',
+                               'yeah', 'high', 'mr', 'better', 'part', 'good', 'first', 'show',
+                               'feel', 'oh', 'else', 'whats', 'knew', 'could', 'none', 'acts',
+                               'bridge', 'everybody', 'doesnt', 'sure', 'put', 'getting', 'later',
+                               'wasnt', 'okay', 'gonna', 'every', 'made', 'youve', 'much', 'theres',
+                               'cover', 'john', 'words', 'person', 'without', 'old', 'kid', 'order',
+                               'ways', 'group', 'point', 'applause', 'adam', 'sarah', 'sara',
+                               'finally', 'suppose', 'effect', 'excellent', 'probably', 'enough',
+                               'thanks', 'guest', 'speak', 'turn', 'ago', 'since', 'havent', 'side',
+                               'week', 'william', 'came', 'talk', 'wait', 'girl', 'sometimes',
+                               'song', 'month', 'sense', 'others', 'days', 'days', 'mit', 'might',
+                               'michael', 'david', 'story', 'place', 'real', 'word', 'told', 'away',
+                               'next', 'find', 'harvard', 'number', 'done', 'night', 'doe', 'long',
+                               'weve', 'best', 'call', 'asked', 'another', 'keep', 'free',
+                               'whether', 'end', 'four', 'door', 'become', 'orleans', 'affect',
+                               'meal', 'tap', 'step', 'room', 'play', 'yes', 'start', 'true',
+                               'last', 'wood', 'sort', 'tony', 'michigan', 'sweet', 'small',
+                               'parent', 'folk', 'mom', 'dad', 'child', 'took', 'pas', 'across',
+                               'amount', 'car', 'eye', 'face', 'bit'])
+
+# create stop words list
+@lru_cache(maxsize=None)
+def new_stopwords():
+    """Returns a frozen set of stop words that joins a custom list with the standard english
+    stop words. The set is built once per process and shared by every caller, so it can't be
+    modified; vectorizers are given sorted(new_stopwords()).
+    """
+
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words('english')).union(CUSTOM_STOP_WORDS)
@@ -0,0 +1,65 @@
+"""
+Regression tests for near-duplicate dropping across cleaning runs: each run starts from the index
+saved by the run before, as data_preprocessing.main does.
+
+Run with: python -m pytest test_data_preprocessing.py
+"""
+
+import pickle
+import random
+
+import pytest
+
+pytest.importorskip('pandas')
+
+import pandas as pd
+
+from data_preprocessing import drop_near_duplicates, unique_indexed_keys
+from near_duplicates import NearDuplicateIndex
+
+WORDS = [first + second for first in 'abcdefghij' for second in 'klmnopqrst']
+
+def transcript(seed, n_words=600):
+    """Returns a cleaned synthetic transcript."""
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words))
+
+def speeches(*rows):
+    """Returns a dataframe of (name, speech) rows, all from the same school and year."""
+    return pd.DataFrame({'name': [name for name, _ in rows], 'school': 'school', 'year': '2000',
+                         'speech': [speech for _, speech in rows]})
+
+def clean_run(speeches_df, index):
+    """Drops near-duplicates the way one cleaning run does and returns the kept names and the
+    index as it would be saved and loaded by the next run.
+    """
+    kept = drop_near_duplicates(speeches_df, index, unique_indexed_keys(index))
+    return kept.name.tolist(), pickle.loads(pickle.dumps(index))
+
+def test_two_uploads_of_one_speech_keep_the_first_across_runs():
+    speech = transcript(1)
+    data = speeches(('A', speech), ('A', speech + ' with a few caption differences'),
+                    ('C', transcript(2)))
+
+    first_run, index = clean_run(data, NearDuplicateIndex())
+    second_run, _ = clean_run(data, index)
+
+    assert first_run == second_run == ['A', 'C']
+
+def test_changed_transcript_is_not_a_near_duplicate_of_its_earlier_version():
+    speech = transcript(1)
+
+    first_run, index = clean_run(speeches(('A', speech), ('C', transcript(2))),
+                                 NearDuplicateIndex())
+    second_run, _ = clean_run(speeches(('A', speech + ' with a corrected caption'),
+                                       ('C', transcript(2))), index)
+
+    assert first_run == second_run == ['A', 'C']
+
+def test_new_near_duplicate_of_an_indexed_speech_is_dropped():
+    speech = transcript(1)
+
+    _, index = clean_run(speeches(('A', speech)), NearDuplicateIndex())
+    second_run, _ = clean_run(speeches(('A', speech), ('B', speech + ' uploaded again')), index)
+
+    assert second_run == ['A']
@@ -0,0 +1,183 @@
+"""
+Behaviour tests for the transcript scraper, run against FakeDriver sessions instead of Chrome:
+results come back in speech order with several workers, a driver that can't be started fails
+only the speech it was meant for, and an interrupted or partly failed run is resumed from the
+journal, scraping only the speeches without a transcript.
+
+Run with: python -m pytest test_web_scraping.py
+"""
+
+import itertools
+import json
+import random
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('selenium')
+
+from benchmarks import FakeDriver
+from web_scraping_npr_youtube import load_journal, scrape_speech_transcripts, \
+    scrape_with_driver_pool, speech_key
+
+SPEECHES = [[f'Speaker {i}', f'School {i}', str(2000 + i)] for i in range(12)]
+
+def search_query(speech):
+    """Returns the YouTube search query the scraper sends for a speech."""
+    return f'{speech[0]} {speech[1]} {speech[2]} commencement speech'
+
+TRANSCRIPTS = {search_query(speech): f'transcript of {speech[0]}' for speech in SPEECHES}
+
+class RecordingDriver(FakeDriver):
+    """FakeDriver that records every search and can't find the options button on the videos of
+    the queries in fail.
+    """
+
+    def __init__(self, searches, fail=()):
+        super().__init__(TRANSCRIPTS)
+        self.searches = searches
+        self.fail = set(fail)
+        self.query = ''
+
+    def get(self, url):
+        super().get(url)
+        self.query = url.split('search_query=', 1)[-1]
+        self.searches.append(self.query)
+
+    def find_element_by_xpath(self, xpath):
+        if self.query in self.fail and 'More actions' in xpath:
+            raise LookupError("no options button")
+        return super().find_element_by_xpath(xpath)
+
+class BrokenSessionDriver(RecordingDriver):
+    """RecordingDriver whose search page never loads for the queries in broken, and which counts
+    how often it is quit.
+    """
+
+    def __init__(self, searches, broken=()):
+        super().__init__(searches)
+        self.broken = set(broken)
+        self.quits = 0
+
+    def get(self, url):
+        super().get(url)
+        if self.query in self.broken:
+            raise TimeoutError("search page never loaded")
+
+    def quit(self):
+        self.quits += 1
+
+class FlakyFactory:
+    """Driver factory whose calls with the given numbers (counting from 1) raise, as when Chrome
+    fails to start. Keeps every driver it returns.
+    """
+
+    def __init__(self, failing_calls, make_driver):
+        self.failing_calls = set(failing_calls)
+        self.make_driver = make_driver
+        self.calls = itertools.count(1)
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            call = next(self.calls)
+        if call in self.failing_calls:
+            raise RuntimeError("chrome failed to start")
+
+        driver = self.make_driver()
+        self.drivers.append(driver)
+        return driver
+
+def pool(driver_factory, n_workers=3):
+    """Runs the driver pool over SPEECHES with no rate limiting or page waits."""
+    return scrape_with_driver_pool(SPEECHES, n_workers, min_interval=0, jitter=0,
+                                   driver_factory=driver_factory, pause=lambda low, high: None)
+
+def scrape(journal_path, searches, fail=(), n_workers=4):
+    """Runs the scraper over SPEECHES with RecordingDriver sessions and no rate limiting. Each
+    page wait is a short random sleep, so workers finish their speeches out of order.
+    """
+
+    return scrape_speech_transcripts(SPEECHES, n_workers, journal_path=str(journal_path),
+                                     min_interval=0, jitter=0,
+                                     driver_factory=lambda: RecordingDriver(searches, fail),
+                                     pause=lambda low, high: time.sleep(random.uniform(0, .005)))
+
+def scraped(speech, transcript=None):
+    """Returns the result expected for a scraped speech."""
+    return speech + [transcript or f'transcript of {speech[0]}']
+
+@pytest.fixture(autouse=True)
+def scratch_dir(tmp_path, monkeypatch):
+    """Runs each test in its own directory, since the scraper pickles its output there."""
+    monkeypatch.chdir(tmp_path)
+
+def test_results_keep_speech_order_with_several_workers(tmp_path):
+    searches = []
+    results = scrape(tmp_path / 'journal.jsonl', searches, n_workers=4)
+
+    assert results == [scraped(speech) for speech in SPEECHES]
+    assert sorted(searches) == sorted(TRANSCRIPTS)
+
+def test_resume_skips_journaled_speeches_and_retries_a_partial_entry(tmp_path):
+    journal_path = tmp_path / 'journal.jsonl'
+    with open(journal_path, 'w', encoding='utf-8') as journal:
+        for speech in SPEECHES[:5]:
+            journal.write(json.dumps({'name': speech[0], 'school': speech[1], 'year': speech[2],
+                                      'transcript': 'journaled'}) + '\n')
+        # the run was killed while writing the sixth entry
+        journal.write('{"name": "Speaker 5", "sch')
+
+    searches = []
+    results = scrape(journal_path, searches, n_workers=3)
+
+    assert sorted(searches) == sorted(search_query(speech) for speech in SPEECHES[5:])
+    assert results == ([scraped(speech, 'journaled') for speech in SPEECHES[:5]]
+                       + [scraped(speech) for speech in SPEECHES[5:]])
+
+def test_rerun_retries_only_failed_speeches(tmp_path):
+    journal_path = tmp_path / 'journal.jsonl'
+    failing = [SPEECHES[2], SPEECHES[7]]
+
+    first_searches = []
+    first = scrape(journal_path, first_searches, fail={search_query(s) for s in failing})
+
+    assert first[2] == first[7] == 'could not find options button'
+    assert first[:2] + first[3:7] + first[8:] == [scraped(speech) for speech in SPEECHES
+                                                  if speech not in failing]
+    assert load_journal(str(journal_path))[speech_key(SPEECHES[2])] == \
+        'could not find options button'
+
+    second_searches = []
+    second = scrape(journal_path, second_searches)
+
+    assert sorted(second_searches) == sorted(search_query(speech) for speech in failing)
+    assert second == [scraped(speech) for speech in SPEECHES]
+
+def test_driver_that_fails_to_start_fails_only_its_speech():
+    factory = FlakyFactory({1, 2}, lambda: RecordingDriver([]))
+    results = pool(factory, n_workers=2)
+
+    failed = [result for result in results if result == 'could not start driver']
+    assert len(failed) == 2
+    assert [result for result in results if isinstance(result, list)] == \
+        [scraped(speech) for speech, result in zip(SPEECHES, results) if result not in failed]
+
+def test_pool_drains_the_queue_when_no_driver_starts():
+    factory = FlakyFactory(range(1, 100), lambda: RecordingDriver([]))
+
+    assert pool(factory) == ['could not start driver'] * len(SPEECHES)
+
+def test_failed_restart_after_a_broken_session_is_recorded_and_recovers():
+    broken = search_query(SPEECHES[0])
+    # the first session breaks on speech 0, and the restart for the next speech fails
+    factory = FlakyFactory({2}, lambda: BrokenSessionDriver([], broken={broken}))
+    results = pool(factory, n_workers=1)
+
+    assert results[0] == 'could not load search results'
+    assert results[1] == 'could not start driver'
+    assert results[2:] == [scraped(speech) for speech in SPEECHES[2:]]
+    assert [driver.quits for driver in factory.drivers] == [1, 1]
@@ -0,0 +1,73 @@
+"""
+Faster cleaning of the speech transcripts. clean_text produces exactly the same text as
+running clean_text_round1 and then clean_text_round2 from data_preprocessing. It makes the same
+sequential passes over the text, one per pattern, but with precompiled patterns, a digit-word
+pattern that doesn't backtrack and the newline replacement done with str.replace. Series are
+cleaned one text at a time with map.
+"""
+
+import re
+import string
+
+from multiprocessing import Pool
+
+import pandas as pd
+
+BRACKETED_RE = re.compile(r'\[.*?\]')
+
+# A character class rather than a str.translate table: translate falls back to a much slower
+# path as soon as a transcript contains a non-ASCII character.
+PUNCTUATION_RE = re.compile('[%s]' % re.escape(string.punctuation))
+
+# Removes the same words as r'\w*\d\w*' (every run of word characters containing a digit), but
+# only tries matches at the start of a word and never backtracks.
+DIGIT_WORD_RE = re.compile(r'\b[^\W\d]*\d\w*')
+
+SMART_QUOTE_RE = re.compile('[‘’“”…]')
+
+def clean_text(text):
+    """Return text with lowercase, removed text in square brackets, removed punctuation, removed
+    words containing numbers, removed smart quotes, and newlines replaced by spaces.
+    """
+
+    text = text.lower()
+    text = BRACKETED_RE.sub('', text)
+    text = PUNCTUATION_RE.sub('', text)
+    text = DIGIT_WORD_RE.sub('', text)
+    text = SMART_QUOTE_RE.sub('', text)
+
+    return text.replace('\n', ' ')
+
+def clean_series(speeches):
+    """Returns a pandas series of cleaned transcripts, cleaning each one with clean_text in a
+    per-text map.
+
+    The pandas string methods are not used: on the pyarrow string dtype .str.lower() differs
+    from str.lower() for some characters (e.g. a final sigma), so the output would no longer
+    match the two cleaning rounds.
+    """
+
+    return speeches.map(clean_text)
+
+def clean_texts(texts, processes=None, chunksize=16):
+    """Returns a list of cleaned transcripts, split across a pool of worker processes.
+
+    Args:
+    texts -- list of transcripts
+    processes -- number of worker processes; defaults to the number of CPUs
+    chunksize -- number of transcripts sent to a worker at a time
+    """
+
+    with Pool(processes) as pool:
+        return pool.map(clean_text, texts, chunksize)
+
+def clean_speeches(speeches, processes=1):
+    """Returns a pandas series of cleaned transcripts. Cleans them in this process by default and
+    with a process pool when processes is greater than one (or None for all CPUs).
+    """
+
+    if processes == 1:
+        return clean_series(speeches)
+
+    cleaned = clean_texts(list(speeches), processes)
+    return pd.Series(cleaned, index=speeches.index, name=speeches.name)
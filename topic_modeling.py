@@ -3,66 +3,129 @@ This script is used to perform topic modeling on NPR's top 350 speeches using no
 factorization, a TF-IDF vectorizer, and lemmatized transcripts.
 """
 
+import os
+import pickle
+import re
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import chain
+from multiprocessing import Pool
+from time import perf_counter
+
+import numpy as np
 import pandas as pd
 
-from sklearn.feature_extraction.text import  TfidfVectorizer
-from sklearn.decomposition import NMF
+from aggregate_cube import slice_rows
+from artifact_store import ArtifactWriter, export_csv, iter_artifact_batches, read_artifact, \
+    read_artifact_metadata, write_artifact
+from instrumentation import count, instrumented, span
+from stop_words import new_stopwords
 
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+LEMMA_CACHE_PATH = 'lemma_cache.pkl'
+MODEL_DIR = 'models'
+MODEL_FORMAT_VERSION = 1
 
-def create_lemmatized_words(speeches_df):
-    """Returns the dataframe with an additional column with the lemmatized transcript."""
+# metadata key of the topic modeling output holding the version of the model that produced it
+OUTPUT_VERSION_KEY = 'topic_model_version'
+
+# topic names assigned after reviewing the top words of each NMF component
+TOPIC_COLUMNS = ['career', 'politics', 'education', 'hope', 'culture']
+VECTORIZER_PARAMS = {'max_df': .8, 'min_df': .3, 'ngram_range': (1, 1)}
+NMF_PARAMS = {'n_components': 5, 'random_state': 19}
+
+# smallest cosine similarity at which a refitted topic takes the name of a saved model's topic
+MIN_TOPIC_MATCH = .5
+
+def load_lemma_cache(cache_path=LEMMA_CACHE_PATH):
+    """Returns the saved dictionary mapping each token to its lemma, or an empty dictionary if no
+    cache has been saved yet.
+    """
+
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path, 'rb') as file:
+        return pickle.load(file)
+
+def save_lemma_cache(cache, cache_path=LEMMA_CACHE_PATH):
+    """Pickles the token to lemma dictionary, replacing the saved cache in a single step."""
+
+    with open(cache_path + '.tmp', 'wb') as file:
+        pickle.dump(cache, file)
+    os.replace(cache_path + '.tmp', cache_path)
+
+def lemmatize_tokens(tokens):
+    """Returns the WordNet lemma of each token in a list."""
+
+    from nltk.stem import WordNetLemmatizer
 
     lem = WordNetLemmatizer()
+    return [lem.lemmatize(token) for token in tokens]
+
+@instrumented
+def lemmatize_vocabulary(tokens, processes=1):
+    """Returns a dictionary mapping each token to its lemma.
+
+    Args:
+    tokens -- collection of distinct tokens
+    processes -- worker processes to split the tokens across; 1 lemmatizes in this process and
+    None uses every CPU
+    """
+
+    tokens = list(tokens)
+
+    if processes == 1:
+        lemmas = lemmatize_tokens(tokens)
+    else:
+        n_chunks = (processes or os.cpu_count()) * 4
+        chunk_size = len(tokens) // n_chunks + 1
+        chunks = [tokens[i:i + chunk_size] for i in range(0, len(tokens), chunk_size)]
+
+        with Pool(processes) as pool:
+            lemmas = list(chain.from_iterable(pool.map(lemmatize_tokens, chunks)))
+
+    return dict(zip(tokens, lemmas))
 
-    speeches_df['lemmatized_words'] = speeches_df.speech.apply(lambda x: x.split())
-    speeches_df.lemmatized_words = speeches_df.lemmatized_words.apply(lambda x: [lem.lemmatize(y)
-                                                                                 for y in x])
-    speeches_df.lemmatized_words = speeches_df.lemmatized_words.apply(lambda x: ' '.join(x))
+@instrumented
+def create_lemmatized_words(speeches_df, cache_path=LEMMA_CACHE_PATH, processes=1):
+    """Returns the dataframe with an additional column with the lemmatized transcript.
+
+    Each distinct token is lemmatized only once, and lemmas are saved in a cache on disk, so later
+    runs only lemmatize tokens they haven't seen before.
+
+    Args:
+    speeches_df -- dataframe with the cleaned transcripts in a 'speech' column
+    cache_path -- location of the persistent lemma cache; None disables it
+    processes -- worker processes used to lemmatize new tokens
+    """
+
+    cache = load_lemma_cache(cache_path) if cache_path else {}
+
+    tokenized = speeches_df.speech.str.split()
+    new_tokens = set(chain.from_iterable(tokenized)).difference(cache)
+    count('lemma_cache', 'new_tokens', len(new_tokens))
+
+    if new_tokens:
+        cache.update(lemmatize_vocabulary(new_tokens, processes))
+        if cache_path:
+            save_lemma_cache(cache, cache_path)
+
+    speeches_df['lemmatized_words'] = [' '.join([cache[token] for token in tokens])
+                                       for tokens in tokenized]
 
     return speeches_df
 
-# create stop words list
-def new_stopwords():
-    """Returns a list of of stop words that joins a custom list with the standard english
-    stop words.
-    """
-
-    my_stop_words = set(['like', 'know', 'im', 'just', 'thank', 'dont', 'youre', 'get', 'would',
-                         'said', 'thats', 'think', 'say', 'things', 'us', 'going', 'way', 'really',
-                         'well', 'many', 'got', 'right', 'something', 'thing', 'didnt', 'wa', 'one',
-                         'went', 'wanted', 'ha', 'one', 'lot', 'mean', 'want', 'congratulations',
-                         'commencement', 'staff', 'speaker', 'trustees', 'board', 'members',
-                         'everything', 'guy', 'someone', 'everyone', 'ive', 'actually', 'theyre',
-                         'youll', 'come', 'dr', 'anything', 'new', 'also', 'says', 'must', 'though',
-                         'even', 'today', 'kind', 'hes', 'stuff', 'somebody', 'gon', 'york', 'day',
-                         'women', 'men', 'woman', 'man', 'lets', 'id', 'guys', 'let', 'tell',
-                         'cant', 'thought', 'great', 'look', 'always', 'cant', 'big', 'see', 'take',
-                         'never', 'back', 'little', 'need', 'maybe', 'every', 'still', 'ever',
-                         'two', 'around', 'honor', 'three', 'please', 'called', 'may', 'yeah',
-                         'high', 'mr', 'better', 'part', 'good', 'first', 'show', 'feel', 'oh',
-                         'else', 'whats', 'knew', 'could', 'none', 'acts', 'bridge', 'everybody',
-                         'doesnt', 'sure', 'put', 'getting', 'later', 'wasnt', 'okay',
-                         'gonna', 'every', 'made', 'youve', 'much', 'theres', 'cover',
-                         'john', 'words', 'person', 'without', 'old', 'kid', 'order',
-                         'ways', 'group', 'point', 'applause', 'adam', 'sarah', 'sara',
-                         'finally', 'suppose', 'effect', 'excellent', 'probably', 'enough',
-                         'thanks', 'guest', 'speak', 'turn', 'ago', 'since', 'havent', 'side',
-                         'week', 'william', 'came', 'talk', 'wait', 'girl', 'sometimes', 'song',
-                         'month', 'sense', 'others', 'days', 'days', 'mit', 'might', 'michael',
-                         'david', 'story', 'place', 'real', 'word', 'told', 'away', 'next',
-                         'find', 'harvard', 'number', 'done', 'night', 'doe', 'long', 'weve',
-                         'best', 'call', 'asked', 'another', 'keep', 'free', 'whether', 'end',
-                         'four', 'door', 'become', 'orleans', 'affect', 'meal', 'tap', 'step',
-                         'room', 'play', 'yes', 'start', 'true', 'last', 'wood', 'sort',
-                         'tony', 'michigan', 'sweet', 'small', 'parent', 'folk', 'mom', 'dad',
-                         'child', 'took', 'pas', 'across', 'amount', 'car', 'eye', 'face', 'bit'])
-
-    eng_stop_words = set(stopwords.words('english'))
-    all_stopwords = eng_stop_words.union(my_stop_words)
-
-    return all_stopwords
+def top_k_indices(values, k):
+    """Returns the indices of the k largest values, largest first, without sorting the rest."""
+
+    k = min(k, len(values))
+    if k == 0:
+        return np.array([], dtype=int)
+
+    top = np.argpartition(values, -k)[-k:]
+    return top[np.argsort(values[top])[::-1]]
 
 def display_topics(model, feature_names, no_top_words, topic_names=None):
     """Helper function for viewing topic modeling results. Displays each topic and
@@ -79,86 +142,659 @@ def display_topics(model, feature_names, no_top_words, topic_names=None):
             print("\nTopic ", i)
         else:
             print("\nTopic: '", topic_names[i], "'")
-        print(", ".join([feature_names[i] for i in topic.argsort()[:-no_top_words - 1:-1]]))
+        print(", ".join([feature_names[i] for i in top_k_indices(topic, no_top_words)]))
 
-def save_topic_modeling_results(data, fit_model):
-    """Returns a dataframe with the results of the topic modeling for each speech concatenated
-    onto the origonal dataframe. Saves this dataframe as a csv for later accessing.
+def categorize_speeches(data, doc_topic, topic_columns=TOPIC_COLUMNS):
+    """Returns a dataframe with the topic weights of each speech concatenated onto the original
+    dataframe and the speech's top topic in a 'top_topic' column.
 
     Args:
     data -- the dataframe used for topic modeling
-    fit_model -- the nmf model used for topic modeling
+    doc_topic -- the document-topic weights from the nmf model
+    topic_columns -- names of the topics, in component order
     """
 
     #create dataframe of topic distrobutions per document to add onto the speeches dataframe
-    topic_columns = ['career', 'politics', 'education', 'hope', 'culture']
-    nmf_df = pd.DataFrame(fit_model, columns=topic_columns)
+    nmf_df = pd.DataFrame(doc_topic, columns=topic_columns)
 
     #concatenate origonal speeches dataframe and topics dataframe
     categorized_speeches = pd.concat((data.reset_index(), nmf_df), axis=1)
     categorized_speeches['top_topic'] = categorized_speeches[topic_columns].idxmax(axis=1)
-    print("Number of speeches per topic:\n", categorized_speeches.top_topic.value_counts())
 
     # remove columns with speech info (no longer needed for analysis)
     categorized_speeches = categorized_speeches.drop(['lemmatized_words', 'index'], axis=1)
 
+    return categorized_speeches
+
+@instrumented
+def save_topic_modeling_results(data, fit_model, topic_columns=TOPIC_COLUMNS, export_csvs=False,
+                                model_version=None):
+    """Returns a dataframe with the results of the topic modeling for each speech concatenated
+    onto the origonal dataframe. Saves this dataframe as the 'topic_modeling_output' artifact
+    for later accessing.
+
+    Args:
+    data -- the dataframe used for topic modeling
+    fit_model -- the nmf model used for topic modeling
+    topic_columns -- names of the topics, in component order
+    export_csvs -- also save the dataframe as a csv for Tableau visualizations
+    model_version -- version of the saved topic model, recorded with the artifact
+    """
+
+    categorized_speeches = categorize_speeches(data, fit_model, topic_columns)
+    print("Number of speeches per topic:\n", categorized_speeches.top_topic.value_counts())
+
+    write_artifact(categorized_speeches, 'topic_modeling_output',
+                   metadata=output_metadata(model_version))
+
     # save the dataframe for Tableau visualizations
-    categorized_speeches.to_csv('topic_modeling_output.csv')
+    if export_csvs:
+        categorized_speeches.to_csv('topic_modeling_output.csv', index=False)
 
     return categorized_speeches
 
-def topic_modeling(data):
+def relative_reconstruction_error(doc_term, doc_topic, components):
+    """Returns ||X - WH|| / ||X|| (Frobenius norms) for a sparse document-term matrix X, without
+    building the dense product WH.
+    """
+
+    residual_squared, x_squared = squared_errors(doc_term, doc_topic, components)
+    return np.sqrt(residual_squared) / np.sqrt(x_squared)
+
+def squared_errors(doc_term, doc_topic, components):
+    """Returns ||X - WH||^2 and ||X||^2 for a sparse document-term matrix X. Both add up over
+    row blocks, so the error of a corpus can be accumulated one chunk at a time.
+    """
+
+    x_squared = doc_term.power(2).sum()
+    cross_term = (doc_topic * (doc_term @ components.T)).sum()
+    wh_squared = ((doc_topic.T @ doc_topic) * (components @ components.T)).sum()
+
+    return max(x_squared - 2 * cross_term + wh_squared, 0), x_squared
+
+def output_metadata(model_version):
+    """Returns the metadata saved with the topic modeling output."""
+    return {OUTPUT_VERSION_KEY: model_version} if model_version is not None else None
+
+def output_model_version(name='topic_modeling_output'):
+    """Returns the version of the topic model that produced the topic modeling output, or None
+    if the output doesn't record one (it was written before versions were recorded).
+    """
+
+    version = read_artifact_metadata(name).get(OUTPUT_VERSION_KEY)
+    return int(version) if version is not None else None
+
+def latest_model_version(model_dir=MODEL_DIR):
+    """Returns the highest saved topic model version in model_dir, or 0 if there is none."""
+
+    if not os.path.isdir(model_dir):
+        return 0
+
+    versions = [int(match.group(1)) for match in
+                (re.fullmatch(r'topic_model_v(\d+)\.pkl', name) for name in os.listdir(model_dir))
+                if match]
+
+    return max(versions, default=0)
+
+@instrumented
+def save_topic_model(vectorizer, model, training_error, n_documents, topic_columns=TOPIC_COLUMNS,
+                     model_dir=MODEL_DIR, version=None):
+    """Pickles the fitted vectorizer and topic model together with the topic names as the next
+    numbered version in model_dir (or as the given version). Returns the saved artifact.
+
+    Args:
+    vectorizer -- the fitted TfidfVectorizer
+    model -- the fitted NMF (or MiniBatchNMF) model
+    training_error -- relative reconstruction error on the documents the model was fit on
+    n_documents -- number of documents the model has seen
+    topic_columns -- names of the topics, in component order
+    model_dir -- directory holding the versioned artifacts
+    version -- version number to save as, e.g. one already recorded with the model's output
+    """
+
+    import sklearn
+
+    if version is None:
+        version = latest_model_version(model_dir) + 1
+    artifact = {'format': MODEL_FORMAT_VERSION,
+                'version': version,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'sklearn_version': sklearn.__version__,
+                'vectorizer': vectorizer,
+                'model': model,
+                'topic_columns': list(topic_columns),
+                'training_error': training_error,
+                'n_documents': n_documents}
+
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, f'topic_model_v{version}.pkl'), 'wb') as file:
+        pickle.dump(artifact, file)
+
+    print(f"Saved topic model version {version} to {model_dir}")
+
+    return artifact
+
+def load_topic_model(version=None, model_dir=MODEL_DIR):
+    """Returns a saved topic model artifact, the latest version unless one is given."""
+
+    if version is None:
+        version = latest_model_version(model_dir)
+    if version == 0:
+        raise FileNotFoundError(f"No saved topic model in {model_dir}")
+
+    with open(os.path.join(model_dir, f'topic_model_v{version}.pkl'), 'rb') as file:
+        artifact = pickle.load(file)
+
+    if artifact['format'] != MODEL_FORMAT_VERSION:
+        raise ValueError(f"Topic model version {version} uses format {artifact['format']}, "
+                         f"expected {MODEL_FORMAT_VERSION}")
+
+    return artifact
+
+@instrumented
+def assign_topics(speeches_df, artifact=None):
+    """Returns the speeches with their topic weights and top topic, using a saved model without
+    refitting it. Only tokens missing from the lemma cache are lemmatized, so this runs in
+    milliseconds for a handful of new speeches.
+
+    Args:
+    speeches_df -- dataframe with cleaned transcripts in a 'speech' column
+    artifact -- a loaded topic model artifact; defaults to the latest saved version
+    """
+
+    if artifact is None:
+        artifact = load_topic_model()
+
+    lemmatized_df = create_lemmatized_words(speeches_df)
+    doc_term = artifact['vectorizer'].transform(lemmatized_df.lemmatized_words)
+    doc_topic = artifact['model'].transform(doc_term)
+
+    return categorize_speeches(lemmatized_df, doc_topic, artifact['topic_columns'])
+
+@instrumented
+def update_topic_model(speeches_df, artifact=None, max_drift=.05, model_dir=MODEL_DIR):
+    """Folds new speeches into a saved topic model with a mini-batch NMF update instead of a full
+    refit, and saves the result as a new version. Returns the new artifact, or None if the new
+    speeches fit the model too poorly (drift above max_drift) and a full refit is needed.
+
+    The vocabulary is kept as is, so the update only makes sense while new speeches use roughly
+    the same words; drift is the increase in relative reconstruction error over the training set.
+    The topic modeling output isn't rewritten, so it (and its search index) stay with the version
+    that produced it.
+
+    Args:
+    speeches_df -- dataframe with the new cleaned transcripts in a 'speech' column
+    artifact -- a loaded topic model artifact; defaults to the latest saved version
+    max_drift -- largest acceptable increase in relative reconstruction error
+    model_dir -- directory holding the versioned artifacts
+    """
+
+    if artifact is None:
+        artifact = load_topic_model(model_dir=model_dir)
+
+    from sklearn.decomposition import MiniBatchNMF
+
+    model = artifact['model']
+    lemmatized_df = create_lemmatized_words(speeches_df)
+    doc_term = artifact['vectorizer'].transform(lemmatized_df.lemmatized_words)
+    doc_topic = model.transform(doc_term)
+
+    new_error = relative_reconstruction_error(doc_term, doc_topic, model.components_)
+    drift = new_error - artifact['training_error']
+    print(f"Relative reconstruction error on new speeches: {new_error:.3f} (drift {drift:+.3f})")
+
+    if drift > max_drift:
+        print("Drift is too large for an online update - refit the model with topic_modeling()")
+        return None
+
+    if isinstance(model, MiniBatchNMF):
+        model.partial_fit(doc_term)
+    else:
+        # start the mini-batch model from the fitted components and continue from there
+        online_model = MiniBatchNMF(model.n_components_, init='custom',
+                                    random_state=NMF_PARAMS['random_state'])
+        online_model.partial_fit(doc_term, W=doc_topic, H=model.components_.copy())
+        model = online_model
+
+    return save_topic_model(artifact['vectorizer'], model, artifact['training_error'],
+                            artifact['n_documents'] + doc_term.shape[0],
+                            artifact['topic_columns'], model_dir)
+
+@instrumented
+def topic_modeling(data, model_dir=MODEL_DIR, export_csvs=False, with_search_index=True):
     """Performs topic modeling using a TF-IDF vectorizer, lemmatization, non-negative matrix
     factorization, a custom list of stop words, and 5 topics. Returns a dataframe with
-    the top topic for each speech indicated in a separate column.
+    the top topic for each speech indicated in a separate column. The fitted vectorizer and
+    model are saved as a new version in model_dir, and by default a search index over the
+    output is saved next to them.
     """
 
+    from sklearn.decomposition import NMF
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
     lemmatized_df = create_lemmatized_words(data)
-    stop_words = new_stopwords()
+    stop_words = sorted(new_stopwords())
 
-    # Use TF-IDF vectorizing
-    vectorizer = TfidfVectorizer(stop_words=stop_words, max_df=.8, min_df=.3, ngram_range=(1, 1))
-    doc_term_object = vectorizer.fit_transform(data.lemmatized_words).toarray()
+    # Use TF-IDF vectorizing - the matrix stays sparse (CSR), NMF works on it directly
+    with span('topic_modeling.vectorize', len(data)):
+        vectorizer = TfidfVectorizer(stop_words=stop_words, **VECTORIZER_PARAMS)
+        doc_term_object = vectorizer.fit_transform(data.lemmatized_words)
 
     # create NMF object and transform the document term object created above
-    nmf = NMF(5, random_state=19)
-    doc_topic = nmf.fit_transform(doc_term_object)
+    with span('topic_modeling.nmf', doc_term_object.shape[0]):
+        nmf = NMF(**NMF_PARAMS)
+        doc_topic = nmf.fit_transform(doc_term_object)
 
     # View top words in each topic
-    display_topics(nmf, vectorizer.get_feature_names(), 20)
+    display_topics(nmf, vectorizer.get_feature_names_out(), 20)
+
+    # Keep the fitted model so new speeches can be assigned topics without refitting
+    training_error = relative_reconstruction_error(doc_term_object, doc_topic, nmf.components_)
+    artifact = save_topic_model(vectorizer, nmf, training_error, doc_term_object.shape[0],
+                                TOPIC_COLUMNS, model_dir)
 
     # Create a dataframe with the top topic for each speach indicated
-    top_topic_per_speech = save_topic_modeling_results(lemmatized_df, doc_topic)
+    top_topic_per_speech = save_topic_modeling_results(lemmatized_df, doc_topic,
+                                                       export_csvs=export_csvs,
+                                                       model_version=artifact['version'])
+
+    if with_search_index:
+        from search_index import update_search_index
+        update_search_index(model_dir)
 
     return top_topic_per_speech
 
-def compare_genders(categorized_speeches):
+# Streaming topic modeling for corpora that don't fit in memory
+
+def artifact_chunks(name='cleaned_speeches', chunk_size=1000):
+    """Returns a function that reads the named artifact as a new iterator of dataframes of at
+    most chunk_size speeches each time it is called.
+    """
+    return lambda: iter_artifact_batches(name, chunk_size)
+
+def mongo_chunks(chunk_size=1000, collection=None):
+    """Returns a function that reads the speeches from MongoDB as a new iterator of dataframes
+    of at most chunk_size speeches each time it is called. The speeches are cleaned as they are
+    read, the same way data_preprocessing.main cleans them for the 'cleaned_speeches' artifact:
+    duplicates and near-duplicates are dropped and the gender column is added.
+    """
+    from data_preprocessing import iter_cleaned_chunks
+
+    def read_chunks():
+        for _, cleaned_speeches in iter_cleaned_chunks(chunk_size, collection=collection):
+            yield cleaned_speeches
+
+    return read_chunks
+
+def vocabulary_vectorizer(read_chunks, stop_words):
+    """Returns a fitted TfidfVectorizer with the vocabulary and idf weights that fitting it on
+    the whole corpus would give, built in one pass over the chunks. Only the document frequency
+    of each term is kept in memory; VECTORIZER_PARAMS' max_df and min_df are applied to them
+    afterwards, and the idf is computed the way TfidfVectorizer does (smooth_idf).
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    analyze = TfidfVectorizer(stop_words=stop_words, **VECTORIZER_PARAMS).build_analyzer()
+    doc_freq = Counter()
+    n_documents = 0
+
+    for chunk in read_chunks():
+        lemmatized_df = create_lemmatized_words(chunk)
+        for text in lemmatized_df.lemmatized_words:
+            doc_freq.update(set(analyze(text)))
+        n_documents += len(lemmatized_df)
+
+    max_df, min_df = VECTORIZER_PARAMS['max_df'], VECTORIZER_PARAMS['min_df']
+    max_count = max_df if isinstance(max_df, int) else max_df * n_documents
+    min_count = min_df if isinstance(min_df, int) else min_df * n_documents
+    terms = sorted(term for term, freq in doc_freq.items() if min_count <= freq <= max_count)
+
+    params = {key: value for key, value in VECTORIZER_PARAMS.items()
+              if key not in ('max_df', 'min_df')}
+    vectorizer = TfidfVectorizer(stop_words=stop_words, vocabulary=terms, **params)
+    frequencies = np.array([doc_freq[term] for term in terms], dtype=float)
+    vectorizer.idf_ = np.log((1 + n_documents) / (1 + frequencies)) + 1
+
+    return vectorizer
+
+def hashed_feature_names(vectorizer, texts, feature_names):
+    """Records the first term seen in each hashed column of a HashingVectorizer, so the topics'
+    top words can be shown. feature_names is updated in place.
+    """
+    from sklearn.utils import murmurhash3_32
+
+    analyze = vectorizer.build_analyzer()
+    n_features = vectorizer.n_features
+    for term in set(chain.from_iterable(map(analyze, texts))):
+        column = abs(murmurhash3_32(term, seed=0)) % n_features
+        if feature_names[column] is None:
+            feature_names[column] = term
+
+def unit_rows(matrix):
+    """Returns a dense matrix with every row scaled to unit length (all-zero rows stay zero)."""
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+def match_topic_names(components, feature_names, model_dir=MODEL_DIR):
+    """Returns names for the topics of a newly fitted model, in component order. NMF components
+    come out in no particular order, so each topic is matched one to one with a topic of the
+    latest saved model by the cosine similarity of their term weights (over the terms both
+    models know), and takes its name if the similarity is at least MIN_TOPIC_MATCH. The other
+    topics, or all of them if there is no saved model to compare with, are named topic_0,
+    topic_1, ...
+
+    Args:
+    components -- the new model's components, one row of term weights per topic
+    feature_names -- term of each column of the components; None for unknown (hashed) columns
+    model_dir -- directory holding the versioned model artifacts
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    names = [None] * len(components)
+
+    reference = load_topic_model(model_dir=model_dir) if latest_model_version(model_dir) else None
+    if reference is not None and hasattr(reference['vectorizer'], 'get_feature_names_out'):
+        reference_columns = {term: column for column, term in
+                             enumerate(reference['vectorizer'].get_feature_names_out())}
+        shared = [(column, reference_columns[term]) for column, term in enumerate(feature_names)
+                  if term in reference_columns]
+
+        if shared:
+            columns, reference_cols = (list(cols) for cols in zip(*shared))
+            topics = components[:, columns]
+            reference_topics = reference['model'].components_[:, reference_cols]
+            similarity = unit_rows(topics) @ unit_rows(reference_topics).T
+
+            for topic, match in zip(*linear_sum_assignment(similarity, maximize=True)):
+                if similarity[topic, match] >= MIN_TOPIC_MATCH:
+                    names[topic] = reference['topic_columns'][match]
+
+    # unmatched topics get neutral names not already taken by a matched topic
+    neutral = (f'topic_{i}' for i in range(2 * len(names)) if f'topic_{i}' not in names)
+    return [name if name is not None else next(neutral) for name in names]
+
+@instrumented
+def streaming_topic_modeling(read_chunks, vectorizer='vocabulary', n_features=2 ** 18,
+                             model_dir=MODEL_DIR, export_csvs=False, with_search_index=True):
+    """Performs the same topic modeling as topic_modeling() without holding the corpus in memory.
+    Speeches are read chunk by chunk, lemmatized, vectorized and fed to a mini-batch NMF, so
+    memory depends on the chunk size and vocabulary, not on the number of speeches. The topic
+    weights of each speech are then appended chunk by chunk to the 'topic_modeling_output'
+    artifact, in the layout save_topic_modeling_results produces, with the topics named by
+    match_topic_names. The fitted vectorizer and model are saved as a new version in model_dir,
+    and by default a search index over the output next to them. Returns the saved model artifact.
+
+    Args:
+    read_chunks -- function returning a new iterator of speech dataframes each time it is called,
+    e.g. artifact_chunks() or mongo_chunks(); the corpus is read three times with the vocabulary
+    vectorizer and twice with the hashing one
+    vectorizer -- 'vocabulary' for TF-IDF over a vocabulary built from document frequencies in a
+    first pass (same features and weights as topic_modeling); 'hashing' for a stateless
+    HashingVectorizer of l2-normalized term counts, which needs no first pass but ignores
+    max_df and min_df
+    n_features -- number of hashed columns for the hashing vectorizer
+    model_dir -- directory holding the versioned model artifacts
+    export_csvs -- also export the output as a csv for Tableau visualizations
+    with_search_index -- also build and save the search index over the output
+    """
+    from sklearn.decomposition import MiniBatchNMF
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    stop_words = sorted(new_stopwords())
+
+    if vectorizer == 'vocabulary':
+        with span('streaming_topic_modeling.vocabulary'):
+            vectorizer = vocabulary_vectorizer(read_chunks, stop_words)
+        feature_names = vectorizer.get_feature_names_out()
+    elif vectorizer == 'hashing':
+        vectorizer = HashingVectorizer(stop_words=stop_words, n_features=n_features,
+                                       alternate_sign=False,
+                                       ngram_range=VECTORIZER_PARAMS['ngram_range'])
+        feature_names = np.full(n_features, None, dtype=object)
+    else:
+        raise ValueError(f"Unknown vectorizer {vectorizer!r}: use 'vocabulary' or 'hashing'")
+
+    # fit pass - each chunk is one mini-batch update of the components
+    nmf = MiniBatchNMF(**NMF_PARAMS)
+    n_documents = 0
+    with span('streaming_topic_modeling.fit'):
+        for chunk in read_chunks():
+            lemmatized_df = create_lemmatized_words(chunk)
+            if isinstance(vectorizer, HashingVectorizer):
+                hashed_feature_names(vectorizer, lemmatized_df.lemmatized_words, feature_names)
+            nmf.partial_fit(vectorizer.transform(lemmatized_df.lemmatized_words))
+            n_documents += len(lemmatized_df)
+
+    # name the topics after the matching topics of the saved model, and view their top words
+    topic_columns = match_topic_names(nmf.components_, feature_names, model_dir)
+    display_topics(nmf, feature_names, 20, topic_columns)
+
+    # output pass - topic weights with the final components, written one chunk at a time and
+    # tagged with the version the model is saved as below
+    version = latest_model_version(model_dir) + 1
+    residual_squared = x_squared = 0
+    with span('streaming_topic_modeling.transform'), \
+         ArtifactWriter('topic_modeling_output', metadata=output_metadata(version)) as output:
+        for chunk in read_chunks():
+            lemmatized_df = create_lemmatized_words(chunk)
+            doc_term = vectorizer.transform(lemmatized_df.lemmatized_words)
+            doc_topic = nmf.transform(doc_term)
+
+            chunk_residual, chunk_x = squared_errors(doc_term, doc_topic, nmf.components_)
+            residual_squared += chunk_residual
+            x_squared += chunk_x
+
+            output.write(categorize_speeches(lemmatized_df, doc_topic, topic_columns))
+
+    if export_csvs:
+        export_csv('topic_modeling_output')
+
+    training_error = np.sqrt(residual_squared / x_squared) if x_squared else 0.
+    print(f"Topic modeled {n_documents} speeches, relative reconstruction error "
+          f"{training_error:.3f}")
+
+    artifact = save_topic_model(vectorizer, nmf, training_error, n_documents, topic_columns,
+                                model_dir, version)
+
+    if with_search_index:
+        from search_index import update_search_index
+        update_search_index(model_dir)
+
+    return artifact
+
+# Topic count and vectorizer sweep
+
+def umass_coherence(doc_term, components, no_top_words=10):
+    """Returns the mean UMass coherence of the topics: for each pair of top words, the log of how
+    often they appear in the same speech relative to how often the higher ranked word appears.
+    Values closer to zero mean more coherent topics.
+
+    Args:
+    doc_term -- sparse document-term matrix the model was fit on
+    components -- topic-word matrix of the model
+    no_top_words -- number of top words per topic to score
+    """
+
+    present = (doc_term > 0).astype(np.int64).tocsc()
+    doc_freq = np.maximum(np.asarray(present.sum(axis=0)).ravel(), 1)
+
+    scores = []
+    for topic in components:
+        top = top_k_indices(topic, no_top_words)
+        co_occurrence = (present[:, top].T @ present[:, top]).toarray()
+        score = sum(np.log((co_occurrence[i, j] + 1) / doc_freq[top[j]])
+                    for i in range(1, len(top)) for j in range(i))
+        scores.append(score)
+
+    return float(np.mean(scores))
+
+_sweep_matrices = None
+
+def _init_sweep_worker(matrices):
+    """Stores the document-term matrices in a sweep worker so each is only sent over once."""
+    global _sweep_matrices
+    _sweep_matrices = matrices
+
+def _add_components(doc_term, doc_topic, components, n_components, random_state):
+    """Returns the factors with random columns of W and rows of H added, scaled like sklearn's
+    random initialization, so a k-topic solution can warm start a larger model.
+    """
+
+    rng = np.random.default_rng(random_state)
+    n_new = n_components - components.shape[0]
+    scale = np.sqrt(doc_term.mean() / n_components)
+
+    new_doc_topic = scale * np.abs(rng.standard_normal((doc_term.shape[0], n_new)))
+    new_components = scale * np.abs(rng.standard_normal((n_new, doc_term.shape[1])))
+
+    return (np.hstack([doc_topic, new_doc_topic]).astype(doc_term.dtype),
+            np.vstack([components, new_components]).astype(doc_term.dtype))
+
+def _fit_component_chain(job):
+    """Fits NMF for an ascending list of topic counts on one document-term matrix, starting each
+    fit from the previous solution when warm_start is set. Returns one result row per fit.
+    """
+
+    from sklearn.decomposition import NMF
+
+    setting, component_counts, warm_start = job
+    doc_term = _sweep_matrices[setting]
+    random_state = NMF_PARAMS['random_state']
+
+    results = []
+    doc_topic = components = None
+    for n_components in sorted(component_counts):
+        start = perf_counter()
+
+        if warm_start and components is not None:
+            doc_topic, components = _add_components(doc_term, doc_topic, components, n_components,
+                                                    random_state)
+            nmf = NMF(n_components, init='custom', random_state=random_state)
+            doc_topic = nmf.fit_transform(doc_term, W=doc_topic, H=components)
+        else:
+            nmf = NMF(n_components, random_state=random_state)
+            doc_topic = nmf.fit_transform(doc_term)
+        components = nmf.components_
+
+        results.append({'setting': setting,
+                        'n_components': n_components,
+                        'warm_start': warm_start and len(results) > 0,
+                        'reconstruction_error': nmf.reconstruction_err_,
+                        'relative_error': relative_reconstruction_error(doc_term, doc_topic,
+                                                                        components),
+                        'coherence': umass_coherence(doc_term, components),
+                        'iterations': nmf.n_iter_,
+                        'seconds': perf_counter() - start})
+
+    return results
+
+@instrumented
+def topic_model_sweep(data, component_grid=range(3, 11), vectorizer_grid=None, processes=None,
+                      warm_start=True, output_path='topic_sweep_results.csv'):
+    """Fits NMF over a grid of topic counts and vectorizer settings and returns a dataframe with
+    the reconstruction error, UMass coherence and wall time of each configuration. Speeches are
+    lemmatized once and each document-term matrix is built once per vectorizer setting; the fits
+    run in a process pool. Saves the results as a csv.
+
+    Args:
+    data -- dataframe with cleaned transcripts in a 'speech' column
+    component_grid -- topic counts to try
+    vectorizer_grid -- list of TfidfVectorizer settings; defaults to VECTORIZER_PARAMS
+    processes -- worker processes; defaults to the number of CPUs
+    warm_start -- start each fit from the solution for the next smaller topic count. Each worker
+    fits a chain of adjacent topic counts, and with warm_start every chain holds at least two,
+    so a large pool may be left partly idle rather than losing the warm starts
+    output_path -- csv file for the results
+    """
+
+    if vectorizer_grid is None:
+        vectorizer_grid = [VECTORIZER_PARAMS]
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    lemmatized_df = create_lemmatized_words(data)
+    stop_words = sorted(new_stopwords())
+
+    matrices = []
+    settings = []
+    for params in vectorizer_grid:
+        start = perf_counter()
+        vectorizer = TfidfVectorizer(stop_words=stop_words, **params)
+        matrices.append(vectorizer.fit_transform(lemmatized_df.lemmatized_words))
+        settings.append({**params, 'vocabulary': len(vectorizer.vocabulary_),
+                         'vectorize_seconds': perf_counter() - start})
+
+    # split the topic counts into ascending runs, one per worker, so each run can warm start
+    n_workers = processes or os.cpu_count()
+    n_counts = len(component_grid)
+    runs_per_setting = max(1, n_workers // len(matrices))
+    if warm_start:
+        # a run of one topic count has no smaller solution to start from
+        runs_per_setting = min(runs_per_setting, max(1, n_counts // 2))
+    component_runs = [list(run) for run in np.array_split(sorted(component_grid), runs_per_setting)
+                      if len(run)]
+    print(f"Fitting {n_counts} topic counts in {len(component_runs)} run(s) of adjacent counts "
+          f"for each of {len(matrices)} vectorizer setting(s)")
+    jobs = [(setting, [int(n) for n in run], warm_start)
+            for setting in range(len(matrices)) for run in component_runs]
+
+    results = []
+    with ProcessPoolExecutor(processes, initializer=_init_sweep_worker,
+                             initargs=(matrices,)) as executor:
+        for run_results in executor.map(_fit_component_chain, jobs):
+            results.extend(run_results)
+
+    sweep_df = pd.DataFrame(results).sort_values(['setting', 'n_components'], ignore_index=True)
+    sweep_df = pd.concat((pd.DataFrame([settings[i] for i in sweep_df.setting]), sweep_df), axis=1)
+    sweep_df = sweep_df.drop('setting', axis=1)
+    sweep_df.to_csv(output_path, index=False)
+    print(sweep_df.to_string(index=False))
+
+    return sweep_df
+
+@instrumented
+def compare_genders(categorized_speeches, cube=None):
     """Prints the topic distrobution for male and female speakers and creates a dataframe with
     the topic distrobitons for each gender. Exports the dataframe as a csv file for Tableau
     visualization.
+
+    Args:
+    categorized_speeches -- the topic modeling output, with 'gender' and 'top_topic' columns
+    cube -- aggregate cube of the speeches by gender and top topic; without one the counts are
+    taken from categorized_speeches with a single groupby
     """
 
-    # create separate dataframes for males and females
-    male_speeches = categorized_speeches[categorized_speeches.gender == '0']
-    female_speeches = categorized_speeches[categorized_speeches.gender == '1']
+    if cube is None:
+        topic_table = slice_rows(categorized_speeches, ['gender', 'top_topic'])
+    else:
+        topic_table = cube.slice('gender', 'top_topic')
 
     # compare percentage of each topic since the number of males > number of females
+    topic_counts = topic_table['count'].unstack('gender', fill_value=0)
+    topic_shares = topic_counts / topic_counts.sum()
+    male_topics = topic_shares['0'].sort_values(ascending=False)
+    female_topics = topic_shares['1'].sort_values(ascending=False)
+
     print('Top male topics:')
-    print(male_speeches.top_topic.value_counts(normalize=True))
+    print(male_topics)
 
     print('Top female topics:')
-    print(female_speeches.top_topic.value_counts(normalize=True))
+    print(female_topics)
 
     # create a dataframe with the topic distrobutions for men and women to visualize in Tableau
-    topic_distro = pd.DataFrame({'men': male_speeches.top_topic.value_counts(normalize=True),
-                                 'women': female_speeches.top_topic.value_counts(normalize=True)})
+    topic_distro = pd.DataFrame({'men': male_topics, 'women': female_topics})
     topic_distro.to_csv('topic_distro_gender.csv')
 
-def main():
+@instrumented
+def main(export_csvs=False):
     """Loads the commencement speech dataframe, calls NMF topic modeling function that includes
     lemmatizaiton and TF-IDF vectorization. Creates a dataframe to compare the results for male
     and female speakers.
     """
-    transcripts_df = pd.read_csv('cleaned_speeches.csv')
-    top_topics = topic_modeling(transcripts_df)
+    transcripts_df = read_artifact('cleaned_speeches')
+    top_topics = topic_modeling(transcripts_df, export_csvs=export_csvs)
     compare_genders(top_topics)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Batched VADER sentiment scoring for speech sections. All sections are scored in one batch across
+a pool of worker processes, and scores are cached by a hash of the section text so unchanged
+sections are never scored twice. Each text gets all four VADER fields: neg, neu, pos and compound.
+"""
+
+import hashlib
+import os
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import pandas as pd
+
+from instrumentation import count, instrumented
+
+VADER_FIELDS = ['neg', 'neu', 'pos', 'compound']
+SCORE_CACHE_PATH = 'vader_cache.pkl'
+
+def text_hash(text):
+    """Returns a 16 byte content hash of a text, used as its key in the score cache."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def load_score_cache(cache_path=SCORE_CACHE_PATH):
+    """Returns the saved dictionary mapping text hashes to VADER scores, or an empty dictionary."""
+
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path, 'rb') as file:
+        return pickle.load(file)
+
+def save_score_cache(cache, cache_path=SCORE_CACHE_PATH):
+    """Pickles the score cache, replacing the saved one in a single step."""
+
+    with open(cache_path + '.tmp', 'wb') as file:
+        pickle.dump(cache, file)
+    os.replace(cache_path + '.tmp', cache_path)
+
+_analyser = None
+
+def _init_worker():
+    """Creates the analyser once per process instead of once per batch."""
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+    global _analyser
+    _analyser = SentimentIntensityAnalyzer()
+
+def _score_batch(texts):
+    """Returns the (neg, neu, pos, compound) scores of each text in a batch."""
+
+    scores = []
+    for text in texts:
+        polarity = _analyser.polarity_scores(text)
+        scores.append(tuple(polarity[field] for field in VADER_FIELDS))
+
+    return scores
+
+@instrumented
+def score_texts(texts, processes=None, cache_path=SCORE_CACHE_PATH, batch_size=256):
+    """Returns a dataframe with the VADER neg, neu, pos and compound scores of each text, in order.
+    Scores are exactly those of SentimentIntensityAnalyzer.polarity_scores.
+
+    Args:
+    texts -- list of texts to score
+    processes -- worker processes; 1 scores in this process, None uses every CPU
+    cache_path -- location of the persistent score cache; None disables it
+    batch_size -- number of texts sent to a worker at a time
+    """
+
+    cache = load_score_cache(cache_path) if cache_path else {}
+    keys = [text_hash(text) for text in texts]
+
+    # score each distinct uncached text once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cache:
+            missing.setdefault(key, text)
+    count('vader_cache', 'texts', len(keys))
+    count('vader_cache', 'texts_scored', len(missing))
+
+    if missing:
+        missing_texts = list(missing.values())
+        batches = [missing_texts[i:i + batch_size]
+                   for i in range(0, len(missing_texts), batch_size)]
+
+        if processes == 1:
+            _init_worker()
+            scores = chain.from_iterable(map(_score_batch, batches))
+        else:
+            with ProcessPoolExecutor(processes, initializer=_init_worker) as executor:
+                scores = list(chain.from_iterable(executor.map(_score_batch, batches)))
+
+        cache.update(zip(missing, scores))
+        if cache_path:
+            save_score_cache(cache, cache_path)
+
+    return pd.DataFrame([cache[key] for key in keys], columns=VADER_FIELDS)
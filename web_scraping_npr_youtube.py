@@ -5,21 +5,21 @@ to serach for the speech on YouTube and then pulls the transcript off of the spe
 video. Data is then uploaded to MongoDB for storage.
 """
 
+import json
 import random
 import os
 import pickle
+import queue
+import threading
 
-from time import sleep
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from pymongo import MongoClient
+from time import sleep, monotonic, perf_counter
 
-import requests
 import pandas as pd
 
+from http_cache import CACHE_DIR, cached_get
+from instrumentation import count, instrumented
+from mongo_store import bulk_upsert_speeches
+
 
 def save_csv(data, file_name):
     """Saves dataframe to csv.
@@ -32,29 +32,28 @@ def save_csv(data, file_name):
 
 # Scrape speech information from NPR
 
-def load_page_for_scraping():
+NPR_URL = 'http://apps.npr.org/commencement/'
+
+def load_page_for_scraping(url=NPR_URL, offline=False, cache_dir=CACHE_DIR):
     """Returns a beautifulSoup result from loading NPR's top 350 commencement speeches
-    found at http://apps.npr.org/commencement/.
-    """
+    found at http://apps.npr.org/commencement/. The page is read through the local response
+    cache, so it is only downloaded again when it has changed.
 
-    url = 'http://apps.npr.org/commencement/'
-    response = requests.get(url)
-    status = response.status_code
+    Args:
+    url -- address of the speech list (a local replay server can stand in for NPR)
+    offline -- if True, replay the saved page from disk without using the network
+    cache_dir -- directory of the response cache
+    """
 
-    if status == 200:
-        page = response.text
-        soup = BeautifulSoup(page, "lxml")
+    from bs4 import BeautifulSoup
 
-    else:
-        print(f"Error code: {status}")
+    page, _ = cached_get(url, cache_dir, offline)
+    soup = BeautifulSoup(page, "lxml")
 
     return soup
 
-def scrape_npr():
-    """Returns a list of NPR's top 350 speeches. The list includes speaker name, school, and year
-    they speech was given.
-    """
-    soup = load_page_for_scraping()
+def parse_speech_list(soup):
+    """Returns a list of [name, school, year] lists parsed from the NPR speech list page."""
 
     speeches = []
     speech_names = soup.find_all('h2', class_='speech-name')
@@ -64,6 +63,46 @@ def scrape_npr():
     for i in range(len(speech_names)):
         speeches.append([speech_names[i].text, speech_schools[i].text, speech_years[i].text])
 
+    return speeches
+
+@instrumented
+def scrape_npr(url=NPR_URL, offline=False, refresh=False, cache_dir=CACHE_DIR):
+    """Returns a list of NPR's top 350 speeches. The list includes speaker name, school, and year
+    they speech was given.
+
+    The parsed list is cached next to the response cache. Repeat runs reuse it without touching
+    the network or parsing the page. With refresh=True the page is revalidated and only parsed
+    again if its content changed.
+
+    Args:
+    url -- address of the speech list
+    offline -- if True, replay the saved page from disk without using the network
+    refresh -- if True, revalidate the page instead of trusting the parsed cache
+    cache_dir -- directory of the response cache
+    """
+
+    parsed_path = os.path.join(cache_dir, 'npr_speeches.json')
+    parsed = None
+    if os.path.exists(parsed_path):
+        with open(parsed_path, encoding='utf-8') as file:
+            parsed = json.load(file)
+        if parsed['url'] != url:
+            parsed = None
+
+    if parsed is not None and not refresh:
+        speeches = parsed['speeches']
+    else:
+        page, digest = cached_get(url, cache_dir, offline)
+
+        if parsed is not None and parsed['sha256'] == digest:
+            speeches = parsed['speeches']
+        else:
+            from bs4 import BeautifulSoup
+            speeches = parse_speech_list(BeautifulSoup(page, "lxml"))
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(parsed_path, 'w', encoding='utf-8') as file:
+                json.dump({'url': url, 'sha256': digest, 'speeches': speeches}, file)
+
     # Save list as dataframe for accessing later
     speech_df = pd.DataFrame.from_records(speeches)
     save_csv(speech_df, 'npr_speech_list')
@@ -72,23 +111,34 @@ def scrape_npr():
 
 # Scrape speech transcripts from YouTube
 
-def gettranscript(speech, i):
-    """Returns a speech transcript from YouTube.
+CHROMEDRIVER_PATH = "/Applications/chromedriver"
+
+def create_driver():
+    """Returns a new Selenium Chrome driver."""
+    from selenium import webdriver
+
+    os.environ["webdriver.chrome.driver"] = CHROMEDRIVER_PATH
+    return webdriver.Chrome(CHROMEDRIVER_PATH)
+
+def random_pause(low, high):
+    """Sleeps for a random number of seconds between low and high."""
+    sleep(random.uniform(low, high))
+
+def fetch_transcript(driver, speech, i, pause=random_pause):
+    """Returns a speech transcript from YouTube using a driver that is already running. If a
+    video or transcript can't be found, returns a message naming the step that failed. The
+    driver is left open so it can be reused for the next speech.
 
     Args:
+    driver -- a Selenium webdriver (or any object with the same interface)
     speech -- a list of the speaker name, school where speech was made, and the delivery year.
     i -- the count to keep track of progress
+    pause -- function called with (low, high) seconds to wait for the page to respond
     """
 
-    sleeptime = [5, 15]
-
-    # connect to selenium driver
-    chromedriver = "/Applications/chromedriver"
-    os.environ["webdriver.chrome.driver"] = chromedriver
-
-    driver = webdriver.Chrome(chromedriver)
-
-    sleep(random.uniform(sleeptime[0], sleeptime[1]))
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
     # set wait conditions for optimal scraper performance
     wait = WebDriverWait(driver, 3)
@@ -99,23 +149,21 @@ def gettranscript(speech, i):
 
     wait.until(visible((By.ID, "video-title")))
     driver.find_element_by_id("video-title").click()
-    sleep(random.uniform(2, 4))
+    pause(2, 4)
 
     # try and except sequence to continue process if a video / transcript does not exist
     try:
         element = driver.find_element_by_xpath('//button[@aria-label="More actions"]')
     except:
         msg = 'could not find options button'
-        driver.quit()
         print(msg)
         return msg
 
     try:
-        sleep(random.uniform(2, 5))
+        pause(2, 5)
         element.click()
     except:
         msg = 'could not click'
-        driver.quit()
         print(msg)
         return msg
 
@@ -124,26 +172,23 @@ def gettranscript(speech, i):
         element = driver.find_element_by_xpath(path)
     except:
         msg = 'could not find transcript in options menu'
-        driver.quit()
         print(msg)
         return msg
 
     try:
-        sleep(random.uniform(2, 5))
+        pause(2, 5)
         element.click()
     except:
         msg = 'could not click'
-        driver.quit()
         print(msg)
         return msg
 
     try:
-        sleep(random.uniform(2, 4))
+        pause(2, 4)
         body_path = '//ytd-transcript-body-renderer[contains(@class, "style-scope")]'
         element = driver.find_element_by_xpath(body_path)
     except:
         msg = 'could not find transcript text'
-        driver.quit()
         print(msg)
         return msg
 
@@ -152,32 +197,239 @@ def gettranscript(speech, i):
     #append transcript to list along with the speaker name, school, and speech year
     body_text_ls = [speech[0], speech[1], speech[2], tscript]
 
-    driver.quit()
     print(f'Speech number {i}, {speech[0]} scraped')
 
     return body_text_ls
 
-def scrape_speech_transcripts(speeches_list):
+def gettranscript(speech, i):
+    """Returns a speech transcript from YouTube using a fresh Chrome driver.
+
+    Args:
+    speech -- a list of the speaker name, school where speech was made, and the delivery year.
+    i -- the count to keep track of progress
+    """
+
+    sleeptime = [5, 15]
+
+    driver = create_driver()
+
+    try:
+        random_pause(sleeptime[0], sleeptime[1])
+        result = fetch_transcript(driver, speech, i)
+    finally:
+        driver.quit()
+
+    if not isinstance(result, list):
+        count('scrape_failures', result)
+
+    return result
+
+class RateLimiter:
+    """Spaces out requests so that a worker starts at most one every `min_interval` seconds,
+    plus up to `jitter` random seconds so requests don't arrive in lockstep.
+    """
+
+    def __init__(self, min_interval, jitter=0, clock=monotonic, sleeper=sleep):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self.clock = clock
+        self.sleeper = sleeper
+        self._next_allowed = 0
+
+    def wait(self):
+        """Blocks until the worker is allowed to make its next request."""
+        now = self.clock()
+        if now < self._next_allowed:
+            self.sleeper(self._next_allowed - now)
+            now = self._next_allowed
+
+        self._next_allowed = now + self.min_interval + random.uniform(0, self.jitter)
+
+@instrumented
+def scrape_with_driver_pool(speeches_list, n_workers=4, min_interval=5, jitter=10,
+                            driver_factory=create_driver, pause=random_pause, on_result=None):
+    """Returns the scraping result for every speech in speeches_list, in the same order. Speeches
+    are handed out from a queue to n_workers threads, each of which keeps one driver session open
+    for its whole run and is rate limited on its own. Prints the overall throughput at the end.
+
+    A worker whose session breaks starts a new one for its next speech. If a session can't be
+    started, that speech fails with 'could not start driver' and the worker moves on, so every
+    speech gets a result.
+
+    Args:
+    speeches_list -- list of [name, school, year] lists
+    n_workers -- number of long-lived driver sessions
+    min_interval -- minimum seconds between two requests made by the same worker
+    jitter -- maximum random seconds added to min_interval
+    driver_factory -- function returning a new driver, e.g. a fake driver for local testing
+    pause -- function called with (low, high) seconds while waiting on page elements
+    on_result -- optional function called with (speech, result) as each speech finishes
+    """
+
+    tasks = queue.Queue()
+    for i, speech in enumerate(speeches_list, start=1):
+        tasks.put((i, speech))
+
+    results = [None] * len(speeches_list)
+    result_lock = threading.Lock()
+
+    def quit_driver(driver):
+        try:
+            driver.quit()
+        except Exception:
+            # the session is already broken - nothing left to close
+            pass
+
+    def worker():
+        limiter = RateLimiter(min_interval, jitter)
+        driver = None
+
+        try:
+            while True:
+                try:
+                    i, speech = tasks.get_nowait()
+                except queue.Empty:
+                    return
+
+                limiter.wait()
+                if driver is None:
+                    try:
+                        driver = driver_factory()
+                    except Exception:
+                        # no session for this speech - it fails and the next one tries again
+                        result = 'could not start driver'
+                        print(result)
+
+                if driver is not None:
+                    try:
+                        result = fetch_transcript(driver, speech, i, pause)
+                    except Exception:
+                        # the search page never loaded - start over with a clean session
+                        result = 'could not load search results'
+                        print(result)
+                        quit_driver(driver)
+                        driver = None
+
+                results[i - 1] = result
+                if not isinstance(result, list):
+                    count('scrape_failures', result)
+                if on_result is not None:
+                    with result_lock:
+                        on_result(speech, result)
+        finally:
+            if driver is not None:
+                quit_driver(driver)
+
+    start = perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(max(1, min(n_workers, len(speeches_list))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    n_scraped = sum(1 for result in results if isinstance(result, list))
+    rate = len(speeches_list) / elapsed * 60 if elapsed else 0
+    print(f"Processed {len(speeches_list)} speeches ({n_scraped} transcripts) in {elapsed:.1f}s "
+          f"with {len(threads)} workers: {rate:.1f} speeches/min")
+
+    return results
+
+JOURNAL_PATH = 'scrape_journal.jsonl'
+
+def speech_key(speech):
+    """Returns the key identifying a speech in the scrape journal: 'name|school|year'."""
+    return '|'.join(speech[:3])
+
+def append_to_journal(journal, speech, result):
+    """Appends the outcome of scraping one speech to an open journal file and flushes it to disk,
+    so the entry survives if the process is killed right after.
+
+    Args:
+    journal -- journal file opened in append mode
+    speech -- a list of the speaker name, school, and year
+    result -- the list returned for a scraped speech, or a gettranscript failure message
+    """
+
+    entry = {'name': speech[0], 'school': speech[1], 'year': speech[2]}
+    if isinstance(result, list):
+        entry['transcript'] = result[3]
+    else:
+        entry['error'] = result
+
+    journal.write(json.dumps(entry) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def end_partial_line(journal_path):
+    """Ends the journal with a newline if a killed run left a partial last entry, so the next
+    entry appended starts on its own line instead of being lost with the partial one.
+    """
+
+    if not os.path.exists(journal_path) or not os.path.getsize(journal_path):
+        return
+
+    with open(journal_path, 'rb+') as journal:
+        journal.seek(-1, os.SEEK_END)
+        if journal.read(1) != b'\n':
+            journal.write(b'\n')
+
+def load_journal(journal_path=JOURNAL_PATH):
+    """Returns a dictionary mapping each journaled speech key to its latest outcome: either the
+    [name, school, year, transcript] list or the failure message.
+    """
+
+    outcomes = {}
+    if not os.path.exists(journal_path):
+        return outcomes
+
+    with open(journal_path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write can leave a partial last line - that speech is retried
+                continue
+
+            speech = [entry['name'], entry['school'], entry['year']]
+            if 'transcript' in entry:
+                outcomes[speech_key(speech)] = speech + [entry['transcript']]
+            else:
+                outcomes[speech_key(speech)] = entry['error']
+
+    return outcomes
+
+@instrumented
+def scrape_speech_transcripts(speeches_list, n_workers=4, journal_path=JOURNAL_PATH,
+                              **pool_options):
     """Pickles and returns a list of all speeches scraped from YouTube. List output includes speaker
-    name, school they spoke at, year of the speech, and the speech transcript. Keeps track of the
-    number of speeches scraped.
+    name, school they spoke at, year of the speech, and the speech transcript. Speeches are scraped
+    in parallel by a pool of n_workers browser sessions.
+
+    Every outcome is appended to the journal as soon as it is known. Re-running skips speeches that
+    were already scraped and retries only the ones that failed or never finished.
     """
 
-    all_scraped_content = []
-    remaining = [speech[0] for speech in speeches_list]
-    i = 1
+    outcomes = load_journal(journal_path)
+    pending = [speech for speech in speeches_list
+               if not isinstance(outcomes.get(speech_key(speech)), list)]
+    print(f"{len(speeches_list) - len(pending)} speeches already scraped, {len(pending)} to go")
+
+    if pending:
+        end_partial_line(journal_path)
+        with open(journal_path, 'a', encoding='utf-8') as journal:
+            scrape_with_driver_pool(pending, n_workers=n_workers,
+                                    on_result=lambda speech, result:
+                                    append_to_journal(journal, speech, result),
+                                    **pool_options)
+        outcomes = load_journal(journal_path)
 
-    for speech in speeches_list:
-        scraped_content = gettranscript(speech, i)
-        all_scraped_content.append(scraped_content)
-        i += 1
-        remaining.pop(0)
+    all_scraped_content = [outcomes.get(speech_key(speech)) for speech in speeches_list]
 
     with open('scraped_content.pkl', 'wb') as file:
         pickle.dump(all_scraped_content, file)
 
-    # Note: if process above breaks, re-run with only the speeches in the remaining list
-
     return all_scraped_content
 
 def load_additional_speeches():
@@ -186,33 +438,46 @@ def load_additional_speeches():
     manually_added_speeches = pickle.load(open("manual_speeches.pkl", "rb"))
     return manually_added_speeches
 
-def upload_to_mongo(speech_content):
-    """Connects to mongo database 'speeches'. Uploads raw commencement speeches into database."""
+@instrumented
+def upload_to_mongo(speech_content, batch_size=100, collection=None):
+    """Connects to mongo database 'speeches'. Uploads raw commencement speeches into database
+    in batches of upserts, so re-uploading a speech never creates a duplicate. Speeches that are
+    near-duplicates of an already cleaned speech are reported; they are still stored, and are
+    left out of the cleaned speeches by data_preprocessing.
 
-    client = MongoClient()
+    Args:
+    speech_content -- list of [name, school, year, speech] lists
+    batch_size -- number of speeches sent to MongoDB per request
+    collection -- optional collection to write to instead of the shared client's
+    """
+    from near_duplicates import known_near_duplicates, load_index
 
-    # connect to database within mongoDB
-    speech_db = client.speeches
+    for speech, canonical, similarity in known_near_duplicates(speech_content, load_index()):
+        count('near_duplicates', 'uploaded')
+        print(f"{speech[0]} ({speech[1]}, {speech[2]}) is a near-duplicate of {canonical[0]} "
+              f"({canonical[1]}, {canonical[2]}), similarity {similarity:.2f}")
 
-    # add each speech to MongoDB
-    for speech in speech_content:
-        speech_dict = {'name': speech[0],
-                       'school': speech[1],
-                       'year': speech[2],
-                       'speech': speech[3]}
-        speech_db.speech_collection.insert_one(speech_dict)
+    bulk_upsert_speeches(speech_content, collection=collection, batch_size=batch_size)
 
     print("All speeches uploaded to Mongo.")
 
-def main():
+@instrumented
+def main(n_workers=4, offline=False):
     """Scrapes information from NPR's top 350 commencement speeches using BeautifulSoup and then
     uses Selenium Chrome driver to pull the transcripts from YouTube.
+
+    Args:
+    n_workers -- number of browser drivers scraping transcripts at once
+    offline -- read the NPR speech list from the local cache instead of the network
     """
     # Pull in speech content
-    speeches = scrape_npr()
-    full_scraped_speeches = scrape_speech_transcripts(speeches)
+    speeches = scrape_npr(offline=offline)
+    full_scraped_speeches = scrape_speech_transcripts(speeches, n_workers)
     additional_speeches = load_additional_speeches()
 
     # Upload both lists to MongoDB
     upload_to_mongo(full_scraped_speeches)
     upload_to_mongo(additional_speeches)
+
+if __name__ == '__main__':
+    main()